@@ -0,0 +1,145 @@
+#!/usr/bin/env python3
+""" 多倍長整数演算のバックエンド
+
+有限体とスカラーのべき乗と逆元の計算, 座標の整数の型を切り替える.
+gmpy2 がインストールされていれば gmpy2 を使い, 無ければ Python の int と pow を使う.
+
+使う側は from backend import ... ではなく backend.invert(...) のように参照すること.
+(set_backend() はこのモジュールの mpz, powmod, invert を置き換える)
+"""
+
+import unittest
+
+try:
+    import gmpy2
+except ImportError:
+    gmpy2 = None
+
+class PythonBackend:
+    """組み込みの int と pow による実装"""
+
+    name = 'python'
+
+    @staticmethod
+    def mpz(n):
+        return n
+
+    @staticmethod
+    def powmod(base, exponent, modulus):
+        return pow(base, exponent, modulus)
+
+    @staticmethod
+    def invert(a, modulus):
+        '''a の逆元 (modulus は素数). a = 0 なら 0 を返す'''
+        return pow(a, modulus - 2, modulus)
+
+class EuclidBackend(PythonBackend):
+    """組み込みの int と, 拡張ユークリッドの互除法による pow(a, -1, m) で逆元を求める実装"""
+
+    name = 'euclid'
+
+    @staticmethod
+    def invert(a, modulus):
+        '''a の逆元 (modulus は素数). a = 0 なら 0 を返す'''
+        if a % modulus == 0:
+            return 0
+        return pow(a, -1, modulus)
+
+class Gmpy2Backend:
+    """gmpy2.mpz による実装
+
+    mpz の乗算と剰余は int より速いので, 点の座標は mpz のまま演算する.
+    powmod と invert の結果は S256Field や to_bytes() でそのまま使えるよう int で返す.
+    """
+
+    name = 'gmpy2'
+
+    @staticmethod
+    def mpz(n):
+        return gmpy2.mpz(n)
+
+    @staticmethod
+    def powmod(base, exponent, modulus):
+        return int(gmpy2.powmod(base, exponent, modulus))
+
+    @staticmethod
+    def invert(a, modulus):
+        '''a の逆元 (modulus は素数). a = 0 なら 0 を返す'''
+        if a % modulus == 0:
+            return 0
+        return int(gmpy2.invert(a, modulus))
+
+BACKENDS = {'python': PythonBackend, 'euclid': EuclidBackend, 'gmpy2': Gmpy2Backend}
+# バックエンドが切り替わったときに呼ぶ関数
+_callbacks = []
+
+def available():
+    '''この環境で使えるバックエンドの名前のリスト'''
+    return [name for name in BACKENDS if name != 'gmpy2' or gmpy2 is not None]
+
+def set_backend(name):
+    '''name のバックエンドに切り替える. 使えない場合は ValueError'''
+    global BACKEND, mpz, powmod, invert
+    if name not in available():
+        raise ValueError(f'backend {name} is not available (choose from {available()})')
+    backend = BACKENDS[name]
+    BACKEND = name
+    mpz = backend.mpz
+    powmod = backend.powmod
+    invert = backend.invert
+    for callback in _callbacks:
+        callback(backend)
+
+def register(callback):
+    '''バックエンドが切り替わるたびに callback(バックエンドのクラス) を呼ぶ. 登録時にも 1 度呼ぶ'''
+    _callbacks.append(callback)
+    callback(BACKENDS[BACKEND])
+
+# gmpy2 があれば gmpy2 を使う
+set_backend('gmpy2' if gmpy2 is not None else 'python')
+
+class TestBackend(unittest.TestCase):
+
+    P = 2 ** 256 - 2 ** 32 - 977
+
+    def check(self, name):
+        backend = BACKENDS[name]
+        a = 0x79be667ef9dcbbac55a06295ce870b07029bfcdb2dce28d959f2815b16f81798
+        inv = backend.invert(a, self.P)
+        self.assertIs(type(inv), int)
+        self.assertEqual(a * inv % self.P, 1)
+        self.assertEqual(backend.invert(0, self.P), 0)
+        self.assertEqual(backend.invert(self.P, self.P), 0)
+        root = backend.powmod(a, (self.P + 1) // 4, self.P)
+        self.assertIs(type(root), int)
+        self.assertEqual(root, pow(a, (self.P + 1) // 4, self.P))
+        self.assertEqual(backend.mpz(a) * backend.mpz(3) % self.P, a * 3 % self.P)
+
+    def test_python(self):
+        self.check('python')
+        self.check('euclid')
+
+    @unittest.skipIf(gmpy2 is None, 'gmpy2 is not installed')
+    def test_gmpy2(self):
+        self.check('gmpy2')
+
+    def test_set_backend(self):
+        saved = BACKEND
+        selected = []
+        register(selected.append)
+        self.assertIs(selected[0], BACKENDS[saved])
+        try:
+            for name in available():
+                set_backend(name)
+                self.assertEqual(BACKEND, name)
+                self.assertIs(invert, BACKENDS[name].invert)
+                self.assertIs(selected[-1], BACKENDS[name])
+            with self.assertRaises(ValueError):
+                set_backend('unknown')
+        finally:
+            _callbacks.remove(selected.append)
+            set_backend(saved)
+        self.assertIn('python', available())
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,278 @@
+#!/usr/bin/env python3
+""" ecc.py のベンチマーク
+
+python bench.py [名前 ...] で実行する. 名前を省略すると全てのベンチマークを実行する.
+"""
+
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import timeit
+import tracemalloc
+from ecc import *
+from ecc import _sequential_range, _vectorized_range
+import backend
+import fieldvec
+from parallel import VerifyThreadPool
+from secp256k1 import GX, GY, jacobian_to_affine, pippenger_window
+
+def _seconds(func, number=1, repeat=3):
+    '''func を number 回実行したときの 1 回あたりの最短時間 (秒)'''
+    return min(timeit.repeat(func, number=number, repeat=repeat)) / number
+
+def bench_trusted():
+    '''演算結果の点で曲線の検査を省いた効果 (FieldElement 上の Point.__rmul__)'''
+    k = 0xc7207fee197d27c618aea621406f6bf5ef6fca38681d82b2f06fddbdce6feab6
+    # 小さい体では逆元が安いので, 検査の割合が大きくなる
+    curves = [('secp256k1', P, GX, GY), ('F_223', 223, 47, 71)]
+    print('trusted construction in Point.__rmul__')
+    for name, prime, x, y in curves:
+        a = FieldElement(A, prime)
+        b = FieldElement(B, prime)
+        point = Point(FieldElement(x, prime), FieldElement(y, prime), a, b)
+        trusted = _seconds(lambda: k * point)
+        saved = Point.__dict__['_trusted']
+        # 全ての演算結果を検査付きのコンストラクタで作る場合と比べる
+        Point._trusted = classmethod(lambda cls, x, y, a, b: cls(x, y, a, b))
+        try:
+            checked = _seconds(lambda: k * point)
+        finally:
+            Point._trusted = saved
+        print(f'  {name:10} checked: {checked * 1000:8.2f} ms'
+              f'  trusted: {trusted * 1000:8.2f} ms ({1 - trusted / checked:.0%} saved)')
+
+def _bytes_per_object(make, count=10000):
+    '''make() で作ったオブジェクトを count 個保持したときの 1 個あたりのバイト数'''
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    objects = [make(i) for i in range(count)]
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return (after - before) / len(objects)
+
+def bench_memory():
+    '''デコードした公開鍵と署名を保持するのに必要なメモリ'''
+    secs = [PrivateKey(i + 1).point.sec() for i in range(10000)]
+    r = 0x37206a0610995c58074999cb9767b87af4c4978db68c06e8e6e81d282047a7c6
+    s = 0x8ca63759c1157ebeaec0d03cecca119fc9a75bf8e6d0fa65c841c8e2738cdaec
+    print('memory per object (including coordinates)')
+    print(f'  S256Point.parse(compressed): {_bytes_per_object(lambda i: S256Point.parse(secs[i])):6.0f} bytes')
+    print(f'  S256Point (jacobian only):   {_bytes_per_object(lambda i: S256Point._from_jacobian((GX + i, GY + i, 1))):6.0f} bytes')
+    print(f'  Signature:                   {_bytes_per_object(lambda i: Signature(r + i, s + i)):6.0f} bytes')
+
+# 新しいプロセスで import ecc と最初の sign() にかかる時間を測る
+_STARTUP_SCRIPT = '''
+import json, sys, time
+start = time.perf_counter()
+import ecc
+imported = time.perf_counter()
+ecc.set_generator_window(int(sys.argv[1]))
+ecc.PrivateKey(12345).sign(67890)
+signed = time.perf_counter()
+print(json.dumps([imported - start, signed - imported]))
+'''
+
+def _startup(window, cache=None):
+    env = dict(os.environ)
+    env.pop('ECC_TABLE_CACHE', None)
+    if cache:
+        env['ECC_TABLE_CACHE'] = cache
+    here = os.path.dirname(os.path.abspath(__file__))
+    runs = []
+    for _ in range(3):
+        output = subprocess.run([sys.executable, '-c', _STARTUP_SCRIPT, str(window)], cwd=here,
+                                env=env, check=True, capture_output=True, text=True).stdout
+        runs.append(json.loads(output))
+    return min(runs, key=sum)
+
+def bench_startup():
+    '''import ecc と最初の sign() にかかる時間 (テーブルを作る場合と保存したものを mmap する場合)'''
+    print('startup: import ecc + first sign()')
+    with tempfile.TemporaryDirectory() as tmpdir:
+        for window in (4, 8):
+            cache = os.path.join(tmpdir, f'g{window}.tbl')
+            # 1 回目でファイルを作る
+            _startup(window, cache)
+            for name, path in (('build', None), ('mmap', cache)):
+                imported, signed = _startup(window, path)
+                print(f'  window {window} {name:5}  import: {imported * 1000:6.1f} ms'
+                      f'  first sign: {signed * 1000:7.1f} ms')
+
+def bench_threads(count=256):
+    '''VerifyThreadPool のスレッド数による検証のスループットの変化
+
+    GIL のある CPython ではほぼ変わらず, GIL の無い CPython (3.13t など) ではコア数まで伸びる.
+    '''
+    items = []
+    for i in range(count):
+        key = PrivateKey(0x1000 + i)
+        z = int.from_bytes(hash256(i.to_bytes(4, 'big')), 'big')
+        items.append((key.point.sec(), key.sign(z).der(), z))
+    is_gil_enabled = getattr(sys, '_is_gil_enabled', lambda: True)
+    print(f'thread scaling of VerifyThreadPool ({count} signatures, '
+          f'GIL {"enabled" if is_gil_enabled() else "disabled"}, {os.cpu_count()} cpus)')
+    base = None
+    for threads in (1, 2, 4, 8):
+        with VerifyThreadPool(workers=threads) as pool:
+            elapsed = _seconds(lambda: pool.verify(items))
+        base = base or elapsed
+        print(f'  {threads} threads: {count / elapsed:8.0f} verify/s  ({base / elapsed:.2f}x)')
+
+def bench_backends():
+    '''多倍長整数のバックエンドごとの sign, verify, parse (圧縮 SEC) の時間'''
+    key = PrivateKey(0xdeadbeef12345)
+    z = int.from_bytes(hash256(b'bench'), 'big')
+    sig = key.sign(z)
+    point = key.point
+    sec = point.sec()
+    saved = backend.BACKEND
+    print('arithmetic backends')
+    try:
+        for name in backend.BACKENDS:
+            if name not in backend.available():
+                print(f'  {name:8} not installed')
+                continue
+            backend.set_backend(name)
+            # テーブルの点をバックエンドの型で作り直す
+            set_generator_window(GENERATOR_WINDOW)
+            generator_table()
+            # parse_cache を通さずに平方根の計算を測る
+            times = [_seconds(lambda: key.sign(z), 20), _seconds(lambda: point.verify(z, sig), 20),
+                     _seconds(lambda: S256Point._parse(sec), 200)]
+            print(f'  {name:8} sign: {times[0] * 1000:6.3f} ms  verify: {times[1] * 1000:6.3f} ms'
+                  f'  parse: {times[2] * 1000:6.3f} ms')
+    finally:
+        backend.set_backend(saved)
+        set_generator_window(GENERATOR_WINDOW)
+
+def bench_fieldvec(count=8192):
+    '''NumPy の一括演算を使った連続する公開鍵の計算と, 整数での計算の比較'''
+    if not fieldvec.available():
+        print('fieldvec: numpy is not installed')
+        return
+    start = 0x12345deadbeef
+    values = [jacobian_to_affine(generator_table().multiply(start + i))[0] for i in range(256)]
+    values = values * (count // len(values))
+    limbs = fieldvec.to_limbs(values)
+    print(f'fieldvec ({count} elements)')
+    print(f'  mul    int: {_seconds(lambda: [v * v % P for v in values]) * 1000:7.2f} ms'
+          f'  numpy: {_seconds(lambda: fieldvec.mul(limbs, limbs)) * 1000:7.2f} ms')
+    print(f'  limbs  to_limbs + from_limbs: {_seconds(lambda: fieldvec.from_limbs(fieldvec.to_limbs(values))) * 1000:7.2f} ms')
+    sequential = _seconds(lambda: [xy for chunk in _sequential_range(start, count, 256) for xy in chunk])
+    vectorized = _seconds(lambda: [xy for chunk in _vectorized_range(start, count) for xy in chunk])
+    print(f'  range  int: {sequential * 1000:7.2f} ms  numpy: {vectorized * 1000:7.2f} ms'
+          f' ({sequential / vectorized:.2f}x)')
+
+def _msm(scalars, points, threshold):
+    saved = S256Point.pippenger_threshold
+    S256Point.pippenger_threshold = threshold
+    try:
+        return S256Point.multi_scalar_mul(scalars, points)
+    finally:
+        S256Point.pippenger_threshold = saved
+
+def bench_msm(sizes=(2, 4, 8, 16, 32, 64, 128, 256, 512, 1024, 2048, 10000)):
+    '''multi_scalar_mul の Strauss 法と Pippenger 法の 1 項あたりの時間 (n = 2 .. 10000)'''
+    points = [S256Point._from_jacobian(generator_table().multiply(i + 1)) for i in range(max(sizes))]
+    batch_normalize(points)
+    scalars = [int.from_bytes(hash256(i.to_bytes(4, 'big')), 'big') % N for i in range(max(sizes))]
+    print(f'multi_scalar_mul per term (pippenger_threshold = {S256Point.pippenger_threshold})')
+    for n in sizes:
+        repeat = 3 if n < 1024 else 1
+        strauss = _seconds(lambda: _msm(scalars[:n], points[:n], n + 1), repeat=repeat)
+        pippenger = _seconds(lambda: _msm(scalars[:n], points[:n], 0), repeat=repeat)
+        print(f'  n = {n:5}  strauss: {strauss / n * 1000:6.3f} ms  pippenger: {pippenger / n * 1000:6.3f} ms'
+              f'  (window {pippenger_window(n)})')
+
+def _compare(funcs, number=200):
+    '''funcs を交互に number 回ずつ実行し, それぞれの 1 回あたりの最短時間 (秒) を返す
+
+    マシンの負荷の変化が片方だけにかからないよう, 交互に測る.
+    '''
+    best = [float('inf')] * len(funcs)
+    for _ in range(number):
+        for i, func in enumerate(funcs):
+            best[i] = min(best[i], _seconds(func, repeat=1))
+    return best
+
+def bench_mul_add():
+    '''verify で使う S256Point.mul_add と u * G + v * P の比較'''
+    point = PrivateKey(0xdeadbeef12345).point
+    u = int.from_bytes(hash256(b'u'), 'big') % N
+    v = int.from_bytes(hash256(b'v'), 'big') % N
+    saved = S256Point.glv
+    print(f'mul_add vs u*G + v*P (backend {backend.BACKEND}, G table window {GENERATOR_WINDOW})')
+    try:
+        for glv in (False, True):
+            S256Point.glv = glv
+            mul_add, separate = _compare([lambda: S256Point.mul_add(u, v, point),
+                                          lambda: u * G + v * point])
+            print(f'  glv={glv!s:5}  mul_add: {mul_add * 1000:6.3f} ms  u*G + v*P: {separate * 1000:6.3f} ms'
+                  f'  ({separate / mul_add:.2f}x)')
+    finally:
+        S256Point.glv = saved
+
+def bench_verify_batch(sizes=(1, 8, 64, 256)):
+    '''verify_batch の件数ごとの 1 署名あたりの時間 (公開鍵が全て異なる場合と全て同じ場合)
+
+    ECDSA では署名ごとの 2 倍算の列を共有できないので, 件数を増やして下がるのは逆元の分だけになる.
+    '''
+    distinct = []
+    same = []
+    signer = PrivateKey(0x4242)
+    for i in range(max(sizes)):
+        key = PrivateKey(0x1000 + i)
+        z = int.from_bytes(hash256(i.to_bytes(4, 'big')), 'big')
+        distinct.append((key.point, z, key.sign(z)))
+        same.append((signer.point, z, signer.sign(z)))
+    print(f'verify_batch per signature (backend {backend.BACKEND}, glv={S256Point.glv})')
+    single = _seconds(lambda: [point.verify(z, sig) for point, z, sig in distinct[:8]]) / 8
+    print(f'  verify():  {single * 1000:6.3f} ms')
+    for n in sizes:
+        repeat = max(3, 64 // n)
+        times = [_seconds(lambda: verify_batch(items[:n]), repeat=repeat) / n for items in (distinct, same)]
+        print(f'  n = {n:4}  distinct keys: {times[0] * 1000:6.3f} ms  same key: {times[1] * 1000:6.3f} ms')
+
+def bench_shared_table():
+    '''共有メモリや mmap の上の G のテーブル (from_buffer) とメモリ上のテーブルでの k * G の比較
+
+    バッファ上の点は最初に引かれたときに整数に変換してプロセスごとに保存するので,
+    全ての点を 1 度引いた後 (warm) はメモリ上のテーブルと同じ速さになる.
+    '''
+    ks = [int.from_bytes(hash256(i.to_bytes(4, 'big')), 'big') % N for i in range(64)]
+    print(f'k * G with a buffer-backed G table (backend {backend.BACKEND})')
+    for window in (4, 8):
+        table = GeneratorTable(window)
+        data = table.to_bytes()
+        in_memory = _seconds(lambda: [table.multiply(k) for k in ks]) / len(ks)
+        # 毎回新しく読むと, 全ての参照が変換を伴う (変換を保存しない場合と同じ)
+        cold = _seconds(lambda: [GeneratorTable.from_buffer(data).multiply(k) for k in ks]) / len(ks)
+        shared = GeneratorTable.from_buffer(data)
+        tracemalloc.start()
+        before = tracemalloc.get_traced_memory()[0]
+        for i in range(len(shared.points)):
+            shared.points[i]
+        decoded = tracemalloc.get_traced_memory()[0] - before
+        tracemalloc.stop()
+        warm = _seconds(lambda: [shared.multiply(k) for k in ks]) / len(ks)
+        print(f'  window {window}  in memory: {in_memory * 1e6:6.1f} us  buffer cold: {cold * 1e6:6.1f} us'
+              f'  buffer warm: {warm * 1e6:6.1f} us  (decoded points: {decoded / 1024:.0f} KiB per process)')
+
+BENCHMARKS = {
+    'trusted': bench_trusted,
+    'memory': bench_memory,
+    'startup': bench_startup,
+    'threads': bench_threads,
+    'backends': bench_backends,
+    'fieldvec': bench_fieldvec,
+    'msm': bench_msm,
+    'mul_add': bench_mul_add,
+    'verify_batch': bench_verify_batch,
+    'shared_table': bench_shared_table,
+}
+
+if __name__ == '__main__':
+    for name in sys.argv[1:] or BENCHMARKS:
+        BENCHMARKS[name]()
@@ -0,0 +1,276 @@
+#!/usr/bin/env python3
+""" キャッシュ関連モジュール
+"""
+
+import unittest
+import threading
+import hashlib
+import os
+from collections import OrderedDict, namedtuple
+
+CacheInfo = namedtuple('CacheInfo', ['hits', 'misses', 'maxsize', 'currsize'])
+
+class LRUCache:
+    """スレッドセーフな大きさ制限付きの LRU キャッシュ
+
+    maxsize 個を超えると最も長く使われていない要素から捨てる. maxsize = 0 なら何も保持しない.
+    """
+
+    def __init__(self, maxsize=1024):
+        if maxsize < 0:
+            raise ValueError(f'maxsize {maxsize} must not be negative')
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __repr__(self):
+        return f'LRUCache({self.info()})'
+
+    def __len__(self):
+        return len(self._data)
+
+    def get(self, key, default=None):
+        '''key に対応する値を返す. 無ければ default を返す'''
+        with self._lock:
+            try:
+                value = self._data[key]
+            except KeyError:
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        with self._lock:
+            if self.maxsize == 0:
+                return
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def resize(self, maxsize):
+        '''大きさの上限を変更する. 溢れた分は古いものから捨てる'''
+        if maxsize < 0:
+            raise ValueError(f'maxsize {maxsize} must not be negative')
+        with self._lock:
+            self.maxsize = maxsize
+            while len(self._data) > maxsize:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        '''全ての要素と統計を消す'''
+        with self._lock:
+            self._data.clear()
+            self.hits = self.misses = 0
+
+    def info(self):
+        '''ヒット数, ミス数, 上限, 現在の要素数を返す'''
+        with self._lock:
+            return CacheInfo(self.hits, self.misses, self.maxsize, len(self._data))
+
+class TestLRUCache(unittest.TestCase):
+
+    def test_get_put(self):
+        cache = LRUCache(2)
+        self.assertIsNone(cache.get(b'a'))
+        cache.put(b'a', 1)
+        cache.put(b'b', 2)
+        self.assertEqual(cache.get(b'a'), 1)
+        # b が最も古いので捨てられる
+        cache.put(b'c', 3)
+        self.assertIsNone(cache.get(b'b'))
+        self.assertEqual(cache.get(b'c'), 3)
+        self.assertEqual(cache.info(), CacheInfo(2, 2, 2, 2))
+
+    def test_resize(self):
+        cache = LRUCache(3)
+        for i in range(3):
+            cache.put(i, i)
+        cache.resize(1)
+        self.assertEqual(len(cache), 1)
+        self.assertEqual(cache.get(2), 2)
+        cache.resize(0)
+        cache.put(4, 4)
+        self.assertEqual(len(cache), 0)
+        cache.clear()
+        self.assertEqual(cache.info(), CacheInfo(0, 0, 0, 0))
+        with self.assertRaises(ValueError):
+            LRUCache(-1)
+
+    def test_threads(self):
+        cache = LRUCache(100)
+        def worker(n):
+            for i in range(1000):
+                cache.put((n, i % 150), i)
+                cache.get((n, (i + 7) % 150))
+        threads = [threading.Thread(target=worker, args=(n,)) for n in range(4)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        info = cache.info()
+        self.assertEqual(info.currsize, 100)
+        self.assertEqual(info.hits + info.misses, 4000)
+
+class ShardedLRUCache:
+    """鍵のハッシュで shards 個の LRUCache に分けたキャッシュ
+
+    シャードごとにロックが別なので, 複数のスレッド (GIL 無しの CPython など) から使っても待ちが少ない.
+    LRU の順序と上限はシャードごとに管理する.
+    """
+
+    def __init__(self, maxsize=1024, shards=16):
+        if shards < 1:
+            raise ValueError(f'shards {shards} must be positive')
+        self._shards = [LRUCache(0) for _ in range(shards)]
+        self.resize(maxsize)
+
+    def __repr__(self):
+        return f'ShardedLRUCache({self.info()}, shards={len(self._shards)})'
+
+    def __len__(self):
+        return sum(len(shard) for shard in self._shards)
+
+    def _shard(self, key):
+        return self._shards[hash(key) % len(self._shards)]
+
+    def get(self, key, default=None):
+        return self._shard(key).get(key, default)
+
+    def put(self, key, value):
+        self._shard(key).put(key, value)
+
+    def resize(self, maxsize):
+        '''全体の上限を変更する. 各シャードには均等に割り当てる'''
+        if maxsize < 0:
+            raise ValueError(f'maxsize {maxsize} must not be negative')
+        self.maxsize = maxsize
+        size, extra = divmod(maxsize, len(self._shards))
+        for i, shard in enumerate(self._shards):
+            shard.resize(size + (1 if i < extra else 0))
+
+    def clear(self):
+        for shard in self._shards:
+            shard.clear()
+
+    def info(self):
+        infos = [shard.info() for shard in self._shards]
+        return CacheInfo(sum(i.hits for i in infos), sum(i.misses for i in infos),
+                         self.maxsize, sum(i.currsize for i in infos))
+
+class TestShardedLRUCache(unittest.TestCase):
+
+    def test_get_put(self):
+        cache = ShardedLRUCache(10, shards=3)
+        self.assertEqual([shard.maxsize for shard in cache._shards], [4, 3, 3])
+        for i in range(100):
+            cache.put(i, i * 2)
+        self.assertLessEqual(len(cache), 10)
+        hits = [i for i in range(100) if cache.get(i) == i * 2]
+        self.assertEqual(len(hits), len(cache))
+        info = cache.info()
+        self.assertEqual((info.hits, info.misses, info.maxsize), (len(hits), 100 - len(hits), 10))
+        cache.resize(0)
+        self.assertEqual(len(cache), 0)
+        cache.clear()
+        self.assertEqual(cache.info(), CacheInfo(0, 0, 0, 0))
+        with self.assertRaises(ValueError):
+            ShardedLRUCache(10, shards=0)
+
+    def test_threads(self):
+        cache = ShardedLRUCache(400, shards=4)
+        def worker(n):
+            for i in range(1000):
+                cache.put((n, i % 50), i)
+                cache.get((n, (i + 7) % 50))
+        threads = [threading.Thread(target=worker, args=(n,)) for n in range(4)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        info = cache.info()
+        self.assertEqual(info.hits + info.misses, 4000)
+        self.assertLessEqual(info.currsize, 400)
+
+class SigCache:
+    """検証に成功した署名のキャッシュ (sigcache)
+
+    (sec, z, r, s) を起動ごとにランダムな salt を付けた sha256 で 32 バイトの鍵にして記録する.
+    1 要素あたり ENTRY_BYTES バイトとして数え, max_bytes を超えないよう古いものから捨てる.
+    要素は ShardedLRUCache に保持するので, 複数のスレッドから使える.
+    """
+
+    # 32 バイトの鍵と OrderedDict の 1 要素分の大きさの見積もり
+    ENTRY_BYTES = 180
+
+    def __init__(self, max_bytes=32 * 1024 * 1024, shards=16):
+        if max_bytes < 0:
+            raise ValueError(f'max_bytes {max_bytes} must not be negative')
+        self.max_bytes = max_bytes
+        self._hasher = hashlib.sha256(os.urandom(32))
+        self._entries = ShardedLRUCache(max_bytes // self.ENTRY_BYTES, shards)
+
+    def __repr__(self):
+        return f'SigCache({self.info()})'
+
+    def __len__(self):
+        return len(self._entries)
+
+    def key(self, sec, z, r, s):
+        '''salt 付きのハッシュによる鍵を返す'''
+        h = self._hasher.copy()
+        h.update(sec)
+        h.update(z.to_bytes(32, 'big'))
+        h.update(r.to_bytes(32, 'big'))
+        h.update(s.to_bytes(32, 'big'))
+        return h.digest()
+
+    def contains(self, key):
+        '''key の署名が検証済みか'''
+        return self._entries.get(key, False)
+
+    def add(self, key):
+        '''key の署名を検証済みとして記録する'''
+        self._entries.put(key, True)
+
+    def clear(self):
+        self._entries.clear()
+
+    def info(self):
+        '''ヒット数, ミス数, 最大の要素数, 現在の要素数を返す'''
+        return self._entries.info()
+
+class TestSigCache(unittest.TestCase):
+
+    def test_contains(self):
+        cache = SigCache()
+        key = cache.key(b'\x02' + bytes(32), 1, 2, 3)
+        self.assertEqual(len(key), 32)
+        self.assertFalse(cache.contains(key))
+        cache.add(key)
+        self.assertTrue(cache.contains(key))
+        self.assertFalse(cache.contains(cache.key(b'\x02' + bytes(32), 1, 2, 4)))
+        info = cache.info()
+        self.assertEqual((info.hits, info.misses, info.currsize), (1, 2, 1))
+
+    def test_salt(self):
+        args = (b'\x03' + bytes(32), 5, 6, 7)
+        self.assertNotEqual(SigCache().key(*args), SigCache().key(*args))
+
+    def test_max_bytes(self):
+        cache = SigCache(max_bytes=SigCache.ENTRY_BYTES * 3, shards=1)
+        keys = [cache.key(b'', i, i, i) for i in range(5)]
+        for key in keys:
+            cache.add(key)
+        self.assertEqual(len(cache), 3)
+        self.assertLessEqual(len(cache) * SigCache.ENTRY_BYTES, cache.max_bytes)
+        self.assertFalse(cache.contains(keys[0]))
+        self.assertTrue(cache.contains(keys[4]))
+        self.assertEqual(len(SigCache(max_bytes=0)), 0)
+
+if __name__ == "__main__":
+    unittest.main()
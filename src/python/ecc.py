@@ -5,22 +5,34 @@
 import unittest
 import hashlib
 import hmac
+import json
+import mmap
+import os
+import pickle
+import struct
+import sys
+import tempfile
+import threading
+import time
 from random import randint
 from helper import *
-
-class FieldElement:
-    """単一の有限体要素
+import backend
+import fieldvec
+from cache import LRUCache, ShardedLRUCache, SigCache
+from secp256k1 import P, A, B, N, BETA, LAMBDA, INFINITY, glv_split, glv_terms, \
+    is_on_curve, field_inverse, field_sqrt, jacobian_add, jacobian_add_affine, \
+    jacobian_negate, jacobian_equal, jacobian_to_affine, \
+    jacobian_batch_to_affine, jacobian_multiply, jacobian_strauss, jacobian_pippenger, \
+    pippenger_window, affine_odd_multiples, glv_fixed_terms
+
+class _FieldElementBase:
+    """有限体要素の演算
+
+    インスタンスは値 num だけを持つ. prime は FieldElement ではインスタンスごと,
+    S256Field ではクラス属性になるので, それぞれのサブクラスで定める.
     """
 
-    def __init__(self, num, prime):
-        if num >= prime or num < 0:
-            error = f'Num {num} not in field range 0 to {prime - 1}'
-            raise ValueError(error)
-        self.num = num
-        self.prime = prime
-
-    def __repr__(self):
-        return f'FieldElement_{self.prime}({self.num})'
+    __slots__ = ('num',)
 
     def __eq__(self, other):
         if other is None:
@@ -60,9 +72,12 @@ class FieldElement:
         num = (self.num * coefficient) % self.prime
         return self.__class__(num, self.prime)
 
+    def __neg__(self):
+        return self.__class__(-self.num % self.prime, self.prime)
+
     def __pow__(self, exponent):
         n = exponent % (self.prime - 1)
-        num = pow(self.num, n, self.prime)
+        num = backend.powmod(self.num, n, self.prime)
         return self.__class__(num, self.prime)
 
     def __truediv__(self, other):
@@ -70,10 +85,42 @@ class FieldElement:
             raise ValueError('other is None')
         if self.prime != other.prime:
             raise TypeError('Cannot divide two numbers in different Fields')
-        num = pow(other.num, self.prime - 2, self.prime)
+        num = backend.invert(other.num, self.prime)
         num = (self.num * num) % self.prime
         return self.__class__(num, self.prime)
 
+class FieldElement(_FieldElementBase):
+    """単一の有限体要素
+    """
+
+    __slots__ = ('prime',)
+
+    def __init__(self, num, prime):
+        if num >= prime or num < 0:
+            error = f'Num {num} not in field range 0 to {prime - 1}'
+            raise ValueError(error)
+        self.num = num
+        self.prime = prime
+
+    def __repr__(self):
+        return f'FieldElement_{self.prime}({self.num})'
+
+def batch_inverse(elements):
+    '''同じ有限体の要素の逆元をまとめて求める
+
+    Montgomery の方法により, n 個の逆元を 1 回のべき乗と約 3n 回の乗算で計算する.
+    '''
+    if not elements:
+        return []
+    prime = elements[0].prime
+    for element in elements:
+        if element.prime != prime:
+            raise TypeError('Cannot invert numbers in different Fields together')
+        if element.num == 0:
+            raise ValueError('Cannot invert zero')
+    invs = batch_inverse_mod([element.num for element in elements], prime)
+    return [element.__class__(inv, prime) for element, inv in zip(elements, invs)]
+
 class TestFieldElement(unittest.TestCase):
     """test class of FieldElement
     """
@@ -124,27 +171,28 @@ class TestFieldElement(unittest.TestCase):
         c = FieldElement(4, 31)
         self.assertEqual(c, a / b)
 
-class Point:
-    """楕円曲線上の点
-    """
+    def test_batch_inverse(self):
+        one = FieldElement(1, 31)
+        elements = [FieldElement(n, 31) for n in (1, 3, 24, 30)]
+        for element, inv in zip(elements, batch_inverse(elements)):
+            self.assertEqual(element * inv, one)
+            self.assertEqual(inv, one / element)
+        self.assertEqual(batch_inverse([]), [])
+        with self.assertRaises(ValueError):
+            batch_inverse([FieldElement(3, 31), FieldElement(0, 31)])
+        with self.assertRaises(TypeError):
+            batch_inverse([FieldElement(3, 31), FieldElement(3, 37)])
 
-    def __init__(self, x, y, a, b):
-        self.a = a
-        self.b = b
-        self.x = x
-        self.y = y
-        if self.x is None and self.y is None:
-            return
-        if self.y ** 2 != self.x ** 3 + a * x + b:
-            raise ValueError(f'({x}, {y}) is not on the curve')
+class _PointBase:
+    """楕円曲線上の点の演算
 
-    def __repr__(self):
-        if self.x is None:
-            return 'Point(infinity)'
-        if isinstance(self.x, FieldElement):
-            return f'Point({self.x.num},{self.y.num})_{self.a.num}_{self.b.num} FieldElement({self.x.prime})'
-        else:
-            return f'Point({self.x},{self.y})_{self.a}_{self.b}'
+    インスタンスは座標 x, y だけを持つ. 曲線のパラメータ a, b は Point ではインスタンスごと,
+    S256Point ではクラス属性になるので, それぞれのサブクラスで定める.
+    """
+
+    __slots__ = ('x', 'y')
+    # スカラー倍で使う wNAF の窓幅. 1 のときは単純なバイナリ法
+    window = 4
 
     def __eq__(self, other):
         return self.x == other.x and self.y == other.y \
@@ -170,7 +218,7 @@ class Point:
             s = (other.y - self.y) / (other.x - self.x)
             x = s ** 2 - self.x - other.x
             y = s * (self.x - x) - self.y
-            return self.__class__(x, y, self.a, self.b)
+            return self._trusted(x, y, self.a, self.b)
 
         if self == other and self.y == 0 * self.x:
             return self.__class__(None, None, self.a, self.b)
@@ -179,19 +227,78 @@ class Point:
             s = (3 * self.x ** 2 + self.a) / (2 * self.y)
             x = s ** 2 - 2 * self.x
             y = s * (self.x - x) - self.y
-            return self.__class__(x, y, self.a, self.b)
+            return self._trusted(x, y, self.a, self.b)
+
+    def __neg__(self):
+        if self.x is None:
+            return self
+        return self._trusted(self.x, -self.y, self.a, self.b)
 
     def __rmul__(self, coefficient):
-        coef = coefficient
-        current = self
+        return self.multiply(coefficient, self.window)
+
+    def multiply(self, coefficient, window=1):
+        '''coefficient * self を幅 window の wNAF で計算する. window = 1 ならバイナリ法'''
+        if coefficient < 0:
+            return (-self).multiply(-coefficient, window)
         result = self.__class__(None, None, self.a, self.b)
-        while coef:
-            if coef & 1:
-                result += current
-            current += current
-            coef >>= 1
+        if window == 1:
+            coef = coefficient
+            current = self
+            while coef:
+                if coef & 1:
+                    result += current
+                current += current
+                coef >>= 1
+            return result
+        # 奇数倍 self, 3self, 5self, ... を呼び出しごとに用意する
+        double = self + self
+        odd = [self]
+        for _ in range((1 << (window - 2)) - 1):
+            odd.append(odd[-1] + double)
+        neg = [-p for p in odd]
+        for d in reversed(wnaf(coefficient, window)):
+            result += result
+            if d > 0:
+                result += odd[d >> 1]
+            elif d < 0:
+                result += neg[-d >> 1]
         return result
 
+class Point(_PointBase):
+    """楕円曲線上の点
+    """
+
+    __slots__ = ('a', 'b')
+
+    def __init__(self, x, y, a, b):
+        self.a = a
+        self.b = b
+        self.x = x
+        self.y = y
+        if self.x is None and self.y is None:
+            return
+        if self.y ** 2 != self.x ** 3 + a * x + b:
+            raise ValueError(f'({x}, {y}) is not on the curve')
+
+    @classmethod
+    def _trusted(cls, x, y, a, b):
+        '''曲線上にあることが分かっている点を検査なしで作る (演算結果用)'''
+        point = cls.__new__(cls)
+        point.a = a
+        point.b = b
+        point.x = x
+        point.y = y
+        return point
+
+    def __repr__(self):
+        if self.x is None:
+            return 'Point(infinity)'
+        if isinstance(self.x, _FieldElementBase):
+            return f'Point({self.x.num},{self.y.num})_{self.a.num}_{self.b.num} FieldElement({self.x.prime})'
+        else:
+            return f'Point({self.x},{self.y})_{self.a}_{self.b}'
+
 class TestPoint(unittest.TestCase):
     """test class of Point
     """
@@ -230,30 +337,174 @@ class TestPoint(unittest.TestCase):
         ans = Point(18, 77, 5, 7)
         self.assertEqual(p1 + p2, ans)
 
-P = 2 ** 256 - 2 ** 32 - 977
-A = 0
-B = 7
-N = 0xfffffffffffffffffffffffffffffffebaaedce6af48a03bbfd25e8cd0364141
+    def test_trusted(self):
+        # 検査しないので曲線上にない点も作れてしまう
+        p = Point._trusted(-1, -2, 5, 7)
+        self.assertEqual((p.x, p.y, p.a, p.b), (-1, -2, 5, 7))
+        self.assertEqual(Point(2, 5, 5, 7) + Point(-1, -1, 5, 7), Point(3, -7, 5, 7))
+        self.assertEqual(-Point(-1, -1, 5, 7), Point(-1, 1, 5, 7))
+
+class S256Field(_FieldElementBase):
+    """secp256k1 の有限体の要素
 
-class S256Field(FieldElement):
+    prime はクラス属性で共有し, 演算は範囲の検査をせずに整数の結果から直接作る.
+    """
+
+    __slots__ = ()
+    prime = P
 
     def __init__(self, num, prime=None):
-        super().__init__(num=num, prime=P)
+        if num >= P or num < 0:
+            error = f'Num {num} not in field range 0 to {P - 1}'
+            raise ValueError(error)
+        object.__setattr__(self, 'num', num)
+
+    @classmethod
+    def _from_int(cls, num):
+        '''0 以上 P 未満であることが分かっている整数から検査なしで作る'''
+        element = cls.__new__(cls)
+        object.__setattr__(element, 'num', num)
+        return element
+
+    def __setattr__(self, name, value):
+        # 要素は共有される点の座標になるので, 点と同じく変更を禁止する
+        raise AttributeError(f'{self.__class__.__name__} is immutable')
 
     def __repr__(self):
         return f'{self.num:064x}'
 
+    def __reduce__(self):
+        # prime はクラス属性なので num だけを保存する
+        return (self.__class__, (self.num,))
+
+    def __add__(self, other):
+        if not isinstance(other, S256Field):
+            return super().__add__(other)
+        return self._from_int((self.num + other.num) % P)
+
+    def __sub__(self, other):
+        if not isinstance(other, S256Field):
+            return super().__sub__(other)
+        return self._from_int((self.num - other.num) % P)
+
+    def __mul__(self, other):
+        if not isinstance(other, S256Field):
+            return super().__mul__(other)
+        return self._from_int(self.num * other.num % P)
+
+    def __rmul__(self, coefficient):
+        return self._from_int(self.num * coefficient % P)
+
+    def __pow__(self, exponent):
+        return self._from_int(backend.powmod(self.num, exponent % (P - 1), P))
+
+    def __truediv__(self, other):
+        if not isinstance(other, S256Field):
+            return super().__truediv__(other)
+        return self._from_int(self.num * field_inverse(other.num) % P)
+
+    def __neg__(self):
+        return self._from_int(-self.num % P)
+
     def sqrt(self):
-        return self**((P + 1) // 4)
+        return self._from_int(field_sqrt(self.num))
+
+class S256Point(_PointBase):
+    """secp256k1 上の点
+
+    内部ではヤコビアン座標 (X, Y, Z) で演算し、アフィン座標 (x = X/Z^2, y = Y/Z^3)
+    は x, y が参照されたときに初めて計算する.
+    """
 
-class S256Point(Point):
+    # x, y はアフィン座標が計算されるまで未設定のままにする
+    __slots__ = ('_jacobian', '_memo_dict')
+    # 曲線のパラメータは全ての点で共有する
+    a = S256Field(A)
+    b = S256Field(B)
+    window = 5
+    # S256Point.parse の結果のキャッシュ. 大きさは parse_cache.resize() で変更できる
+    # 複数のスレッドから parse されても待ちが少ないよう, シャードに分ける
+    parse_cache = ShardedLRUCache(1024)
+    # 検証に成功した署名のキャッシュ. SigCache を設定すると有効になる
+    sig_cache = None
+    # True のとき GLV 分解を使って 2 倍算の回数を半分にする
+    glv = False
+    # multi_scalar_mul で項の数がこれ以上なら Pippenger 法, 未満なら Strauss 法を使う
+    pippenger_threshold = 128
 
     def __init__(self, x, y, a=None, b=None):
-        a, b = S256Field(A), S256Field(B)
-        if type(x) == int:
-            super().__init__(x=S256Field(x), y=S256Field(y), a=a, b=b)
+        if x is None and y is None:
+            jacobian = INFINITY
         else:
-            super().__init__(x=x, y=y, a=a, b=b)
+            if type(x) == int:
+                x, y = S256Field(x), S256Field(y)
+            if not is_on_curve(x.num, y.num):
+                raise ValueError(f'({x}, {y}) is not on the curve')
+            jacobian = (x.num, y.num, 1)
+        object.__setattr__(self, 'x', x)
+        object.__setattr__(self, 'y', y)
+        object.__setattr__(self, '_jacobian', jacobian)
+
+    @classmethod
+    def _trusted(cls, x, y, a=None, b=None):
+        point = cls._from_jacobian((x.num, y.num, 1))
+        object.__setattr__(point, 'x', x)
+        object.__setattr__(point, 'y', y)
+        return point
+
+    @classmethod
+    def _from_jacobian(cls, jacobian):
+        '''ヤコビアン座標から点を作る. 演算結果は曲線上にあるので検査しない'''
+        point = cls.__new__(cls)
+        object.__setattr__(point, '_jacobian', jacobian)
+        return point
+
+    def __getattr__(self, name):
+        # x, y がまだ計算されていない場合のみ呼ばれる
+        if name not in ('x', 'y'):
+            raise AttributeError(name)
+        self._normalize()
+        return getattr(self, name)
+
+    def __reduce__(self):
+        # a, b はクラス属性なのでヤコビアン座標だけを保存する
+        return (self._from_jacobian, (self._jacobian,))
+
+    def _is_normalized(self):
+        '''アフィン座標が計算済みか'''
+        try:
+            object.__getattribute__(self, 'x')
+        except AttributeError:
+            return False
+        return True
+
+    def _normalize(self):
+        '''ヤコビアン座標をアフィン座標に変換して x, y に設定する'''
+        if self._jacobian[2] == 0:
+            self._set_affine(None, None)
+            return
+        x, y = jacobian_to_affine(self._jacobian)
+        self._set_affine(S256Field._from_int(x), S256Field._from_int(y))
+
+    def _set_affine(self, x, y):
+        # 複数のスレッドが同時に設定しても値は同じなので, ロックは不要
+        # (x だけが見えた場合も y は __getattr__ でもう 1 度計算される)
+        object.__setattr__(self, 'x', x)
+        object.__setattr__(self, 'y', y)
+
+    def __setattr__(self, name, value):
+        # 点は parse_cache などで共有され, sec() などの結果も保存するので変更を禁止する
+        raise AttributeError(f'{self.__class__.__name__} is immutable')
+
+    def _memo(self):
+        '''sec(), hash160(), address() の結果を保存する辞書. 最初に使われたときに作る'''
+        try:
+            return object.__getattribute__(self, '_memo_dict')
+        except AttributeError:
+            # 別のスレッドと同時に作ると片方の辞書が捨てられるが, 結果を計算し直すだけで済む
+            memo = {}
+            object.__setattr__(self, '_memo_dict', memo)
+            return memo
 
     def __repr__(self):
         if self.x is None:
@@ -261,31 +512,134 @@ class S256Point(Point):
         else:
             return f'S256Point({self.x}, {self.y})'
 
+    def __eq__(self, other):
+        if not isinstance(other, S256Point):
+            return super().__eq__(other)
+        return jacobian_equal(self._jacobian, other._jacobian)
+
+    def __add__(self, other):
+        if not isinstance(other, S256Point):
+            return super().__add__(other)
+        return self._from_jacobian(jacobian_add(self._jacobian, other._jacobian))
+
+    def __neg__(self):
+        return self._from_jacobian(jacobian_negate(self._jacobian))
+
     def __rmul__(self, coefficient):
+        if not _configured:
+            configure()
         coef = coefficient % N
-        return super().__rmul__(coef)
+        if self is G:
+            return self._from_jacobian(generator_table().multiply(coef))
+        return self.multiply(coef, self.window, self.glv)
+
+    def multiply(self, coefficient, window=1, glv=False):
+        '''coefficient * self をヤコビアン座標の wNAF で計算する. window = 1 ならバイナリ法
+
+        glv が True のときはスカラーを GLV 分解し, 2 つの半分の長さのスカラーを同時に掛ける.
+        '''
+        coef = coefficient % N
+        if glv:
+            terms = glv_terms(self._jacobian, coef)
+            return self._from_jacobian(jacobian_strauss(terms, max(window, 2)))
+        return self._from_jacobian(jacobian_multiply(self._jacobian, coef, window))
+
+    @classmethod
+    def multi_scalar_mul(cls, scalars, points):
+        '''sum(scalars[i] * points[i]) を計算する
+
+        項の数が pippenger_threshold 未満なら全ての項で 2 倍算を共有する Strauss 法,
+        それ以上なら Pippenger のバケット法を使う. glv が True ならスカラーを GLV 分解してから計算する.
+        '''
+        if not _configured:
+            configure()
+        scalars = list(scalars)
+        points = list(points)
+        if len(scalars) != len(points):
+            raise ValueError(f'{len(scalars)} scalars for {len(points)} points')
+        terms = [(point._jacobian, k % N) for k, point in zip(scalars, points)]
+        if cls.glv:
+            terms = [term for p, k in terms for term in glv_terms(p, k)]
+        terms = [(p, k) for p, k in terms if k and p[2] != 0]
+        if not terms:
+            return cls._from_jacobian(INFINITY)
+        if len(terms) < cls.pippenger_threshold:
+            return cls._from_jacobian(jacobian_strauss(terms, max(cls.window, 2)))
+        bits = max(k.bit_length() for _, k in terms)
+        return cls._from_jacobian(jacobian_pippenger(terms, pippenger_window(len(terms), bits)))
+
+    @classmethod
+    def mul_add(cls, u, v, point):
+        '''u * G + v * point を 2 倍算を共有する Strauss 法で計算する
+
+        v * point は wNAF (glv が True なら GLV 分解した 2 項) で計算する. u * G は G のテーブルの
+        行を奇数倍の表として使う項 (GeneratorTable.wnaf_terms) に分け, 同じ 2 倍算の列の中で混合加算する.
+        '''
+        if not _configured:
+            configure()
+        u %= N
+        v %= N
+        if cls.glv:
+            terms = glv_terms(point._jacobian, v)
+        else:
+            terms = [(point._jacobian, v)]
+        # u の区切りを v の 2 倍算の回数に合わせる
+        bits = max(k.bit_length() for _, k in terms)
+        fixed = generator_table().wnaf_terms(u, bits)
+        return cls._from_jacobian(jacobian_strauss(terms, max(cls.window, 2), fixed))
 
     def verify(self, z, sig):
-        s_inv = pow(sig.s, N - 2, N)
+        # 範囲外の r, s は to_bytes(32) できず, 無限遠点は sec() を持たないので,
+        # キャッシュの鍵を作る前に除く
+        if not 0 < sig.r < N or not 0 < sig.s < N or self._jacobian[2] == 0:
+            return False
+        cache = S256Point.sig_cache
+        if cache is not None:
+            key = cache.key(self.sec(), z % N, sig.r, sig.s)
+            if cache.contains(key):
+                return True
+        s_inv = backend.invert(sig.s, N)
         u = z * s_inv % N
         v = sig.r * s_inv % N
-        total = u * G + v * self
-        return total.x.num == sig.r
+        total = S256Point.mul_add(u, v, self)
+        if total.x is None or total.x.num != sig.r:
+            return False
+        if cache is not None:
+            cache.add(key)
+        return True
 
     def sec(self, compressed=True):
         '''SECフォーマットをバイナリ形式にて返す'''
+        memo = self._memo()
+        key = ('sec', compressed)
+        if key in memo:
+            return memo[key]
         if compressed:
             if self.y.num % 2 == 0:
-                return b'\x02' + self.x.num.to_bytes(32, 'big')
+                result = b'\x02' + self.x.num.to_bytes(32, 'big')
             else:
-                return b'\x03' + self.x.num.to_bytes(32, 'big')
+                result = b'\x03' + self.x.num.to_bytes(32, 'big')
         else:
-            return b'\x04' + self.x.num.to_bytes(32, 'big') + \
+            result = b'\x04' + self.x.num.to_bytes(32, 'big') + \
                 self.y.num.to_bytes(32, 'big')
+        memo[key] = result
+        return result
 
     @classmethod
     def parse(self, sec_bin):
-        '''SECバイナリ(16進数ではない)からPointオブジェクトを返す'''
+        '''SECバイナリ(16進数ではない)からPointオブジェクトを返す
+
+        同じ公開鍵は何度も現れるので, 結果を parse_cache に保存して平方根と曲線の検査を省く.
+        '''
+        key = bytes(sec_bin)
+        point = S256Point.parse_cache.get(key)
+        if point is None:
+            point = S256Point._parse(key)
+            S256Point.parse_cache.put(key, point)
+        return point
+
+    @classmethod
+    def _parse(self, sec_bin):
         if sec_bin[0] == 4:
             x = int.from_bytes(sec_bin[1:33], 'big')
             y = int.from_bytes(sec_bin[33:65], 'big')
@@ -308,21 +662,617 @@ class S256Point(Point):
             return S256Point(x, odd_beta)
 
     def hash160(self, compressed=True):
-        return hash160(self.sec(compressed))
+        memo = self._memo()
+        key = ('hash160', compressed)
+        if key not in memo:
+            memo[key] = hash160(self.sec(compressed))
+        return memo[key]
 
     def address(self, compressed=True, testnet=False):
         '''アドレスの文字列を返す'''
+        memo = self._memo()
+        key = ('address', compressed, testnet)
+        if key in memo:
+            return memo[key]
         h160 = self.hash160(compressed)
         if testnet:
             prefix = b'\x6f'
         else:
             prefix = b'\x00'
-        return encode_base58_checksum(prefix + h160)
+        result = encode_base58_checksum(prefix + h160)
+        memo[key] = result
+        return result
 
 G = S256Point(
     0x79be667ef9dcbbac55a06295ce870b07029bfcdb2dce28d959f2815b16f81798,
     0x483ada7726a3c4655da4fbfc0e1108a8fd17b448a68554199c47d08ffb10d4b8)
 
+class _BufferPoints:
+    """バッファ上に 64 バイトずつ並んだ (x, y) を点のリストとして読む. バッファはコピーしない
+
+    バイト列から整数への変換は表を引くたびに行うと乗算が 2 割から 5 割ほど遅くなるので,
+    点ごとに最初に引かれたときに 1 度だけ変換してこのプロセスのリストに保存する.
+    変換した点の分だけプロセスごとのメモリを使う (全ての点で window 4 の表は約 100 KB, window 8 は約 1 MB).
+    """
+
+    __slots__ = ('_buffer', '_decoded')
+
+    def __init__(self, buffer):
+        self._buffer = buffer
+        self._decoded = [None] * (len(buffer) // 64)
+
+    def __len__(self):
+        return len(self._decoded)
+
+    def __getitem__(self, i):
+        point = self._decoded[i]
+        if point is None:
+            offset = i * 64
+            buffer = self._buffer
+            mpz = backend.mpz
+            point = (mpz(int.from_bytes(buffer[offset:offset + 32], 'big')),
+                     mpz(int.from_bytes(buffer[offset + 32:offset + 64], 'big')))
+            # 複数のスレッドが同時に変換しても同じ値なので, ロックは不要
+            self._decoded[i] = point
+        return point
+
+class GeneratorTable:
+    """G の固定基底乗算用の事前計算テーブル
+
+    スカラーを window ビットずつに区切り, i 番目の区切りについて
+    d * 2^(window*i) * G (d = 1 .. 2^window - 1) をアフィン座標で保持する.
+    乗算は区切りごとに表を引いて加算するだけなので 2 倍算が不要になる.
+    window を大きくすると速くなるが, 点の数 (256/window) * (2^window - 1) だけメモリを使う.
+
+    to_bytes() でヘッダ (HEADER) と 64 バイトずつの点を並べたバイト列にでき,
+    from_buffer() で共有メモリや mmap したファイルの上のテーブルをコピーせずに使える.
+    """
+
+    # マジック, バージョン, window, 予約
+    HEADER = struct.Struct('>4sBBH')
+    MAGIC = b'G256'
+    VERSION = 1
+
+    def __init__(self, window=4, points=None):
+        if window < 1:
+            raise ValueError(f'window {window} must be positive')
+        self.window = window
+        self.size = (1 << window) - 1
+        self.rows = (256 + window - 1) // window
+        # 行ごとの wNAF 用の奇数倍. odd_multiples() が最初に使われたときに作る
+        self._odd = {}
+        if points is not None:
+            if len(points) != self.rows * self.size:
+                raise ValueError(f'table for window {window} needs {self.rows * self.size} points')
+            self.points = points
+            return
+        points = []
+        base = G._jacobian
+        for _ in range(self.rows):
+            multiple = base
+            for d in range(self.size):
+                points.append(multiple)
+                multiple = jacobian_add(multiple, base)
+            # multiple は 2^window * base になっている
+            base = multiple
+        # 乗算の結果の座標が backend.mpz の型になるよう, 表の点を変換しておく
+        mpz = backend.mpz
+        self.points = [(mpz(x), mpz(y)) for x, y in jacobian_batch_to_affine(points)]
+
+    def __repr__(self):
+        return f'GeneratorTable(window={self.window}, points={len(self.points)})'
+
+    def to_bytes(self):
+        '''ヘッダと点を並べたバイト列を返す'''
+        result = [self.HEADER.pack(self.MAGIC, self.VERSION, self.window, 0)]
+        for x, y in self.points:
+            result.append(int(x).to_bytes(32, 'big') + int(y).to_bytes(32, 'big'))
+        return b''.join(result)
+
+    @classmethod
+    def from_buffer(cls, buffer):
+        '''to_bytes() の形式のバッファ (bytes, 共有メモリ, mmap など) をコピーせずにテーブルとして使う'''
+        view = memoryview(buffer)
+        if len(view) < cls.HEADER.size:
+            raise ValueError('buffer too short for a generator table')
+        magic, version, window, _ = cls.HEADER.unpack(view[:cls.HEADER.size])
+        if magic != cls.MAGIC or version != cls.VERSION:
+            raise ValueError(f'unknown generator table format {magic!r} version {version}')
+        size = ((256 + window - 1) // window) * ((1 << window) - 1)
+        body = view[cls.HEADER.size:cls.HEADER.size + size * 64]
+        return cls(window, _BufferPoints(body))
+
+    def odd_multiples(self, row):
+        '''row 行目の基点 Q = 2^(window*row) * G の奇数倍 Q, 3Q, 5Q, ... とその符号反転を返す
+
+        行の点は Q の 1 .. 2^window - 1 倍なので, 窓幅 window + 1 の wNAF にそのまま使える.
+        '''
+        tables = self._odd
+        if row not in tables:
+            offset = row * self.size
+            odd = [tuple(self.points[offset + d - 1]) for d in range(1, self.size + 1, 2)]
+            # 複数のスレッドが同時に作っても同じ内容なので, ロックは不要
+            tables[row] = (odd, [(x, P - y) for x, y in odd])
+        return tables[row]
+
+    def wnaf_terms(self, coefficient, bits):
+        '''coefficient * G を jacobian_strauss の fixed に渡す項に分けて返す
+
+        スカラーを bits (window の倍数に切り上げる) ビットずつ区切り, i 番目の区切りを
+        2^(bits*i) * G の倍数として, その奇数倍を表の行から取る. 2 倍算は bits 回ほどで済む.
+        '''
+        bits = -(-max(bits, 1) // self.window) * self.window
+        coef = coefficient % N
+        mask = (1 << bits) - 1
+        terms = []
+        row = 0
+        while coef:
+            if coef & mask:
+                terms.append((coef & mask, self.window + 1) + self.odd_multiples(row))
+            coef >>= bits
+            row += bits // self.window
+        return terms
+
+    def multiply(self, coefficient):
+        '''coefficient * G をヤコビアン座標で返す'''
+        coef = coefficient % N
+        mask = self.size
+        points = self.points
+        result = INFINITY
+        offset = -1
+        while coef:
+            d = coef & mask
+            if d:
+                result = jacobian_add_affine(result, points[offset + d])
+            coef >>= self.window
+            offset += self.size
+        return result
+
+GENERATOR_WINDOW = 4
+# G のテーブルを保存するファイル. 設定されていればテーブルを作らずに mmap する
+GENERATOR_TABLE_CACHE = os.environ.get('ECC_TABLE_CACHE')
+_generator_table = None
+# 複数のスレッドが同時に最初の乗算をしても, テーブルを 1 度だけ作るためのロック
+_generator_table_lock = threading.Lock()
+
+def generator_table():
+    '''G の事前計算テーブルを返す. 最初に使われたときに作成する'''
+    global _generator_table
+    table = _generator_table
+    if table is not None:
+        return table
+    if not _configured:
+        # バックエンドを決めてからテーブルを作る
+        configure()
+    with _generator_table_lock:
+        if _generator_table is None:
+            table = None
+            if GENERATOR_TABLE_CACHE:
+                try:
+                    table = load_generator_table(GENERATOR_TABLE_CACHE, GENERATOR_WINDOW)
+                except OSError:
+                    # 保存できない場合はメモリ上に作る
+                    pass
+            _generator_table = table or GeneratorTable(GENERATOR_WINDOW)
+        return _generator_table
+
+def _map_generator_table(path):
+    '''to_bytes() の後ろに sha256 のチェックサムを付けたファイルを mmap してテーブルにする'''
+    with open(path, 'rb') as f:
+        data = memoryview(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ))
+    if len(data) < 32 or hashlib.sha256(data[:-32]).digest() != data[-32:]:
+        raise ValueError(f'{path} is corrupt')
+    return GeneratorTable.from_buffer(data[:-32])
+
+def load_generator_table(path, window=None):
+    '''path に保存した G のテーブルを mmap して返す
+
+    ファイルが無い, 壊れている, 形式や window が違う場合はテーブルを作り直して保存する.
+    '''
+    if window is None:
+        window = GENERATOR_WINDOW
+    try:
+        table = _map_generator_table(path)
+        if table.window == window:
+            return table
+    except (OSError, ValueError):
+        pass
+    data = GeneratorTable(window).to_bytes()
+    # 他のプロセスが読みかけのファイルを壊さないよう, 別名で書いてから置き換える
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)))
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data + hashlib.sha256(data).digest())
+        os.replace(tmp, path)
+    except BaseException:
+        os.unlink(tmp)
+        raise
+    return _map_generator_table(path)
+
+def attach_generator_table(buffer):
+    '''to_bytes() の形式のバッファ上のテーブルを G の乗算に使う. コピーはしない'''
+    global GENERATOR_WINDOW, _generator_table
+    if not _configured:
+        # 最初の乗算で設定が変わってもテーブルが入れ替わらないよう, 先に設定を決める
+        configure()
+    table = GeneratorTable.from_buffer(buffer)
+    with _generator_table_lock:
+        GENERATOR_WINDOW = table.window
+        _generator_table = table
+    return table
+
+def _rebind_generator_table():
+    '''バックエンドを切り替えた後, G のテーブルの点の型を新しいバックエンドに合わせる
+
+    メモリ上に作ったテーブルは次に使われたときに作り直す. バッファ上のテーブル
+    (attach_generator_table や ECC_TABLE_CACHE) は他のプロセスと共有しているので残し,
+    変換済みの点だけを捨てる.
+    '''
+    global _generator_table
+    with _generator_table_lock:
+        table = _generator_table
+        if table is not None and isinstance(table.points, _BufferPoints):
+            _generator_table = GeneratorTable(table.window, _BufferPoints(table.points._buffer))
+        else:
+            _generator_table = None
+
+def set_generator_window(window):
+    '''G のテーブルの window 幅を変更する. テーブルは次に使われたときに作り直す'''
+    global GENERATOR_WINDOW, _generator_table
+    if window < 1:
+        raise ValueError(f'window {window} must be positive')
+    with _generator_table_lock:
+        GENERATOR_WINDOW = window
+        _generator_table = None
+
+# 設定を固定する環境変数. 例: ECC_CONFIG=backend=python,window=5,glv=0
+CONFIG_OVERRIDE = os.environ.get('ECC_CONFIG')
+# 測定した設定を保存するファイル. 設定されていれば最初の乗算の前に測定し, 以後はファイルを読む
+CALIBRATION_FILE = os.environ.get('ECC_CALIBRATION')
+_configured = False
+_config_lock = threading.Lock()
+
+def current_config():
+    '''乗算と逆元の計算に使っている設定 (バックエンド, S256Point の window と glv) を返す'''
+    return {'backend': backend.BACKEND, 'window': S256Point.window, 'glv': S256Point.glv}
+
+def parse_config(text):
+    '''backend=python,window=5,glv=0 の形式の文字列を設定の辞書にする'''
+    config = {}
+    for item in text.split(','):
+        if not item.strip():
+            continue
+        name, _, value = item.partition('=')
+        name, value = name.strip(), value.strip()
+        if name == 'backend':
+            config[name] = value
+        elif name == 'window':
+            config[name] = int(value)
+        elif name == 'glv':
+            if value.lower() not in ('0', '1', 'false', 'true'):
+                raise ValueError(f'glv must be 0 or 1, not {value}')
+            config[name] = value.lower() in ('1', 'true')
+        else:
+            raise ValueError(f'unknown config {name}')
+    return config
+
+def apply_config(config):
+    '''設定を反映する. 含まれていない項目は変更しない'''
+    if config.get('window', 2) < 1:
+        raise ValueError(f'window {config["window"]} must be positive')
+    if 'backend' in config and config['backend'] != backend.BACKEND:
+        backend.set_backend(config['backend'])
+        _rebind_generator_table()
+    if 'window' in config:
+        S256Point.window = config['window']
+    if 'glv' in config:
+        S256Point.glv = config['glv']
+
+def _best_time(func, repeat=3):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+def calibrate(windows=(2, 3, 4, 5, 6), repeat=3):
+    '''この環境で最も速い設定を測定して返す. 設定は変更しない
+
+    バックエンドは 1 回の乗算とアフィン座標への変換, スカラーの逆元の時間で選び,
+    そのバックエンドで window と glv の組み合わせのうち乗算が最も速いものを選ぶ.
+    '''
+    saved = backend.BACKEND
+    k = 0xc7207fee197d27c618aea621406f6bf5ef6fca38681d82b2f06fddbdce6feab6
+    try:
+        times = {}
+        for name in backend.available():
+            backend.set_backend(name)
+            p = tuple(map(backend.mpz, G._jacobian))
+            times[name] = _best_time(
+                lambda: (jacobian_to_affine(jacobian_multiply(p, k, 4)), backend.invert(k, N)), repeat)
+        best = min(times, key=times.get)
+        backend.set_backend(best)
+        point = S256Point._from_jacobian(tuple(map(backend.mpz, G._jacobian)))
+        times = {}
+        for window in windows:
+            for glv in (False, True):
+                times[window, glv] = _best_time(lambda: point.multiply(k, window, glv), repeat)
+        window, glv = min(times, key=times.get)
+    finally:
+        backend.set_backend(saved)
+    return {'backend': best, 'window': window, 'glv': glv}
+
+def _load_calibration(path):
+    '''path に保存した設定を返す. 無い, 壊れている, 別の Python で測定した場合は None'''
+    try:
+        with open(path) as f:
+            saved = json.load(f)
+        config = {name: saved[name] for name in ('backend', 'window', 'glv')}
+    except (OSError, ValueError, KeyError, TypeError):
+        return None
+    # 型の違う値 ("window": "5" など) も壊れているとみなし, 測定し直す
+    window = config['window']
+    if not isinstance(config['backend'], str) or not isinstance(config['glv'], bool) \
+            or not isinstance(window, int) or isinstance(window, bool) or window < 1:
+        return None
+    if saved.get('python') != sys.version or config['backend'] not in backend.available():
+        return None
+    return config
+
+def _save_calibration(path, config):
+    data = json.dumps(dict(config, python=sys.version))
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)))
+    try:
+        with os.fdopen(fd, 'w') as f:
+            f.write(data)
+        os.replace(tmp, path)
+    except BaseException:
+        os.unlink(tmp)
+        raise
+
+def configure(override=None, path=None):
+    '''環境変数に従って設定を決めて反映し, その設定を返す. 最初の乗算の前に自動で呼ばれる
+
+    override (省略時は ECC_CONFIG) があればそれを使い, 測定はしない.
+    path (省略時は ECC_CALIBRATION) があれば保存した設定を使い, 無ければ calibrate() して保存する.
+    どちらも無ければ既定の設定のままにする.
+    '''
+    global _configured
+    if override is None:
+        override = CONFIG_OVERRIDE
+    if path is None:
+        path = CALIBRATION_FILE
+    with _config_lock:
+        if override:
+            apply_config(parse_config(override))
+        elif path:
+            config = _load_calibration(path)
+            if config is None:
+                config = calibrate()
+                try:
+                    _save_calibration(path, config)
+                except OSError:
+                    # 保存できなくても測定した設定は使う
+                    pass
+            apply_config(config)
+        # 反映できてから設定済みにする. 不正な設定は毎回例外になり, 他のスレッドは
+        # 反映が終わるまでロックで待つ (calibrate() の乗算は configure() を呼ばない)
+        _configured = True
+        return current_config()
+
+def batch_normalize(points):
+    '''S256Point のリストのアフィン座標をまとめて計算する
+
+    sec() や address() を大量に出力する前に呼ぶと, 逆元の計算が 1 回で済む.
+    '''
+    pending = [p for p in points if not p._is_normalized()]
+    coords = jacobian_batch_to_affine([p._jacobian for p in pending])
+    for point, xy in zip(pending, coords):
+        if xy is None:
+            point._set_affine(None, None)
+        else:
+            point._set_affine(S256Field._from_int(xy[0]), S256Field._from_int(xy[1]))
+    return points
+
+def verify_batch(items):
+    '''(公開鍵, z, Signature) の組をまとめて検証し, 検証に失敗した添字のリストを返す
+
+    s の逆元と, 公開鍵ごとの wNAF 用の奇数倍の表のアフィン座標をそれぞれ 1 回の逆元計算でまとめて求める.
+    同じ公開鍵の表は共有する. u * G + v * P は mul_add と同じく G のテーブルを使う項と共に 2 倍算を
+    共有して計算し, R の x 座標は X == r * Z^2 で比較するので, 1 件ごとの逆元計算が不要になる.
+
+    ECDSA の署名は R の y 座標を含まないので, 複数の署名の式をひとつの multi_scalar_mul に
+    まとめることはできない. 1 件ごとの 2 倍算の列 (約 256 回, GLV なら約 128 回) は共有できず,
+    件数を増やしても 1 件あたりの時間は逆元の分しか下がらない. (bench.py verify_batch)
+    '''
+    failed = []
+    valid = []
+    cache = S256Point.sig_cache
+    keys = {}
+    for i, (point, z, sig) in enumerate(items):
+        # verify と同じく, 範囲外の r, s と無限遠点の公開鍵はキャッシュの鍵を作る前に失敗とする
+        if not 0 < sig.r < N or not 0 < sig.s < N or point._jacobian[2] == 0:
+            failed.append(i)
+            continue
+        if cache is not None:
+            keys[i] = cache.key(point.sec(), z % N, sig.r, sig.s)
+            if cache.contains(keys[i]):
+                continue
+        valid.append(i)
+    if not _configured:
+        configure()
+    window = max(S256Point.window, 2)
+    glv = S256Point.glv
+    table = generator_table()
+    s_invs = batch_inverse_mod([items[i][2].s for i in valid], N)
+    points = list({items[i][0]._jacobian: None for i in valid})
+    odd_tables = dict(zip(points, affine_odd_multiples(points, window)))
+    for i, s_inv in zip(valid, s_invs):
+        point, z, sig = items[i]
+        u = z * s_inv % N
+        v = sig.r * s_inv % N
+        odd_table = odd_tables[point._jacobian]
+        if glv:
+            fixed = glv_fixed_terms(odd_table, v, window)
+        else:
+            fixed = [(v, window) + odd_table]
+        bits = max((k.bit_length() for k, _, _, _ in fixed), default=0)
+        x, _, z3 = jacobian_strauss([], window, fixed + table.wnaf_terms(u, bits))
+        if z3 == 0 or x != sig.r * z3 * z3 % P:
+            failed.append(i)
+        elif cache is not None:
+            cache.add(keys[i])
+    return sorted(failed)
+
+def verify_serialized(items):
+    '''(SEC, DER 形式の署名, z) の組をまとめて検証し, 結果を bool のリストで返す
+
+    公開鍵や署名が読めない項目は失敗とする.
+    '''
+    results = [False] * len(items)
+    index = []
+    batch = []
+    for i, (sec, der, z) in enumerate(items):
+        try:
+            batch.append((S256Point.parse(sec), z, Signature.parse(der)))
+        except (ValueError, IndexError):
+            continue
+        index.append(i)
+        results[i] = True
+    for j in verify_batch(batch):
+        results[index[j]] = False
+    return results
+
+def derive_range(start_secret, count, compressed=True, testnet=False, chunk=256):
+    '''start_secret から連続する count 個の秘密鍵について (秘密鍵, SEC, アドレス) を順に返す
+
+    公開鍵は P_{i+1} = P_i + G で逐次求め, chunk 個ごとにまとめてアフィン座標に変換する.
+    NumPy が使えて count が大きいときは, fieldvec.affine_range() でまとめて計算する.
+    '''
+    if start_secret < 1 or count < 0 or start_secret + count > N:
+        raise ValueError(f'secrets {start_secret} .. {start_secret + count - 1} not in range 1 to {N - 1}')
+    if fieldvec.enabled(count):
+        chunks = _vectorized_range(start_secret, count)
+    else:
+        chunks = _sequential_range(start_secret, count, chunk)
+    secret = start_secret
+    for coords in chunks:
+        for x, y in coords:
+            point = S256Point._trusted(S256Field._from_int(x), S256Field._from_int(y))
+            yield secret, point.sec(compressed), point.address(compressed, testnet)
+            secret += 1
+
+def _sequential_range(start_secret, count, chunk):
+    '''start_secret * G からの連続する count 個の点のアフィン座標を chunk 個ずつのリストで返す'''
+    g = G._jacobian[:2]
+    current = generator_table().multiply(start_secret)
+    end = start_secret + count
+    secret = start_secret
+    while secret < end:
+        points = []
+        for _ in range(min(chunk, end - secret)):
+            points.append(current)
+            current = jacobian_add_affine(current, g)
+        yield jacobian_batch_to_affine(points)
+        secret += len(points)
+
+def _vectorized_range(start_secret, count):
+    '''_sequential_range と同じ点を fieldvec.RANGE_CHUNK 個ずつ NumPy で計算する'''
+    end = start_secret + count
+    for secret in range(start_secret, end, fieldvec.RANGE_CHUNK):
+        n = min(fieldvec.RANGE_CHUNK, end - secret)
+        coords = None
+        # MIN_BATCH 個より少ない最後の端数は整数で計算した方が速い
+        if n >= fieldvec.MIN_BATCH:
+            base = jacobian_to_affine(generator_table().multiply(secret))
+            coords = fieldvec.affine_range(base, n)
+        if coords is None:
+            # 端数や, 小さい秘密鍵などで base = ±i * G となる場合
+            coords = next(_sequential_range(secret, n, n))
+        yield coords
+
+class TestVerifyBatch(unittest.TestCase):
+
+    def test_batch_normalize(self):
+        points = [k * G + G for k in range(1, 6)] + [N * G, G]
+        expected = [(p.x, p.y) for p in [k * G + G for k in range(1, 6)]]
+        batch_normalize(points)
+        for point in points:
+            self.assertTrue(point._is_normalized())
+        self.assertEqual([(p.x, p.y) for p in points[:5]], expected)
+        self.assertIsNone(points[5].x)
+        self.assertEqual(points[0].sec(), (2 * G).sec())
+
+    def test_verify_batch(self):
+        items = []
+        for i in range(8):
+            key = PrivateKey(0x1000 + i)
+            z = int.from_bytes(hash256(bytes([i])), 'big')
+            items.append((key.point, z, key.sign(z)))
+        self.assertEqual(verify_batch(items), [])
+        point, z, sig = items[2]
+        items[2] = (point, z + 1, sig)
+        point, z, sig = items[5]
+        items[5] = (items[6][0], z, sig)
+        items.append((point, z, Signature(sig.r, 0)))
+        self.assertEqual(verify_batch(items), [2, 5, 8])
+        for i, (point, z, sig) in enumerate(items[:8]):
+            self.assertEqual(point.verify(z, sig), i not in (2, 5))
+        self.assertEqual(verify_batch([]), [])
+        # 同じ公開鍵の署名は奇数倍の表を共有する. 無限遠点の公開鍵は失敗する
+        key = PrivateKey(0x4242)
+        items += [(key.point, z, key.sign(z)) for z in (1, 2, 3)]
+        items.append((S256Point(None, None), 1, Signature(1, 1)))
+        saved = S256Point.window
+        try:
+            for window, glv in ((5, True), (1, False), (1, True)):
+                S256Point.window, S256Point.glv = window, glv
+                self.assertEqual(verify_batch(items), [2, 5, 8, 12])
+        finally:
+            S256Point.window, S256Point.glv = saved, False
+
+    def test_verify_serialized(self):
+        key = PrivateKey(0x777)
+        sig = key.sign(10)
+        items = [(key.point.sec(), sig.der(), 10), (key.point.sec(False), sig.der(), 10),
+                 (key.point.sec(), sig.der(), 11), (key.point.sec(), b'\x30', 10),
+                 (b'\x02', sig.der(), 10)]
+        self.assertEqual(verify_serialized(items), [True, True, False, False, False])
+
+    def test_sig_cache(self):
+        key = PrivateKey(0xabc)
+        items = [(key.point, z, key.sign(z)) for z in (1, 2, 3)]
+        items.append((key.point, 4, items[0][2]))
+        S256Point.sig_cache = SigCache()
+        try:
+            point, z, sig = items[0]
+            self.assertTrue(point.verify(z, sig))
+            self.assertTrue(point.verify(z, sig))
+            self.assertFalse(point.verify(z + 1, sig))
+            info = S256Point.sig_cache.info()
+            self.assertEqual((info.hits, info.misses, info.currsize), (1, 2, 1))
+            self.assertEqual(verify_batch(items), [3])
+            self.assertEqual(verify_batch(items), [3])
+            info = S256Point.sig_cache.info()
+            self.assertEqual((info.hits, info.currsize), (1 + 1 + 3, 3))
+            # DER の 33 バイトの整数から読んだ 256 ビットを超える r, s
+            long_int = b'\x02\x21\x01' + bytes(32)
+            for der in (b'\x30\x26' + long_int + b'\x02\x01\x01', b'\x30\x26\x02\x01\x01' + long_int):
+                sig = Signature.parse(der)
+                self.assertGreaterEqual(max(sig.r, sig.s), 2 ** 256)
+                self.assertFalse(point.verify(z, sig))
+            self.assertFalse(point.verify(z, Signature(0, 1)))
+            self.assertFalse(point.verify(z, Signature(1, N)))
+            # 無限遠点の公開鍵は sec() を持たないが, 例外にならず失敗する.
+            # (u * G の x 座標を r にした署名は v * P = 0 なので, 検査しないと成功してしまう)
+            inf = S256Point(None, None)
+            forged = Signature((7 * G).x.num, pow(7, -1, N))
+            self.assertFalse(inf.verify(1, forged))
+            self.assertEqual(verify_batch(items + [(inf, 1, forged)]), [3, 4])
+        finally:
+            S256Point.sig_cache = None
+
 class TestS256Point(unittest.TestCase):
     """test class of Point with FieldElement
     """
@@ -376,6 +1326,26 @@ class TestS256Point(unittest.TestCase):
                 ans = Point(FieldElement(x2, prime), FieldElement(y2, prime), a, b)
             self.assertEqual(sum, ans)
 
+    def test_wnaf_multiply(self):
+        prime = 223
+        a = FieldElement(0, prime)
+        b = FieldElement(7, prime)
+        p = Point(FieldElement(47, prime), FieldElement(71, prime), a, b)
+        for s in range(0, 45):
+            expected = p.multiply(s)
+            for window in (2, 3, 4, 5):
+                self.assertEqual(p.multiply(s, window), expected)
+        self.assertEqual(4 * p, Point(FieldElement(194, prime), FieldElement(51, prime), a, b))
+        self.assertEqual(-3 * p, 18 * p)
+
+    def test_s256_wnaf_multiply(self):
+        point = 0xcafebabe * G
+        for k in (1, 2, 3, 0xdeadbeef, 2 ** 255 + 1, N - 1):
+            expected = point.multiply(k)
+            for window in (2, 4, 5, 6):
+                self.assertEqual(point.multiply(k, window), expected)
+        self.assertEqual(point.multiply(N, 5), S256Point(None, None))
+
     def test_s256point_verify(self):
         z = 0xbc62d4b80d9e36da29c16c5d4d9f11731f36052c72401a76c23c0fb5a9b74423
         r = 0x37206a0610995c58074999cb9767b87af4c4978db68c06e8e6e81d282047a7c6
@@ -421,8 +1391,372 @@ class TestS256Point(unittest.TestCase):
         point = e*G
         #print(point)
 
+    def test_jacobian_double(self):
+        x = 0xc6047f9441ed7d6d3045406e95c07cd85c778e4b8cef3ca7abac09b95c709ee5
+        y = 0x1ae168fea63dc339a3c58419466ceaeef7f632653266d0e1236431a950cfe52a
+        self.assertEqual(G + G, S256Point(x, y))
+        self.assertEqual(2 * G, S256Point(x, y))
+        self.assertEqual((G + G).x.num, x)
+        self.assertEqual((G + G).y.num, y)
+
+    def test_jacobian_matches_affine(self):
+        p = 12345 * G
+        q = 67890 * G
+        affine = Point.__add__(S256Point(p.x, p.y), S256Point(q.x, q.y))
+        self.assertEqual(p + q, affine)
+        self.assertEqual((p + q).x, affine.x)
+        self.assertEqual((12345 + 67890) * G, affine)
+
+    def test_parse_validates(self):
+        sec = (2 * G).sec(compressed=False)
+        self.assertEqual(S256Point.parse(sec), 2 * G)
+        bad = sec[:-1] + bytes([sec[-1] ^ 1])
+        with self.assertRaises(ValueError):
+            S256Point.parse(bad)
+        p = S256Point._trusted(G.x, G.y)
+        self.assertEqual(p, G)
+        self.assertEqual(Point.__add__(p, p), 2 * G)
+
+    def test_slots(self):
+        for obj in (S256Field(1), G, 2 * G, Signature(1, 2), FieldElement(1, 7)):
+            self.assertFalse(hasattr(obj, '__dict__'))
+        # クラス属性で共有する prime, a, b の枠をインスタンスに持たない
+        for cls, name in ((S256Field, 'prime'), (S256Point, 'a'), (S256Point, 'b')):
+            self.assertFalse(any(name in getattr(c, '__slots__', ()) for c in cls.__mro__))
+        self.assertLess(sys.getsizeof(S256Field(1)), sys.getsizeof(FieldElement(1, 7)))
+        p = 2 * G
+        self.assertFalse(p._is_normalized())
+        self.assertIs(p.a, G.a)
+        self.assertEqual(p.x, (G + G).x)
+        self.assertTrue(p._is_normalized())
+        for obj in (p, S256Field(5), Signature(1, 2), S256Point(None, None)):
+            copied = pickle.loads(pickle.dumps(obj))
+            self.assertEqual(repr(copied), repr(obj))
+
+    def test_parse_cache(self):
+        saved = S256Point.parse_cache
+        S256Point.parse_cache = LRUCache(2)
+        try:
+            sec = (3 * G).sec()
+            p = S256Point.parse(sec)
+            self.assertIs(S256Point.parse(bytearray(sec)), p)
+            self.assertEqual(S256Point.parse_cache.info().hits, 1)
+            S256Point.parse((4 * G).sec())
+            S256Point.parse((5 * G).sec(compressed=False))
+            # 最も古い 3G は捨てられている
+            self.assertIsNot(S256Point.parse(sec), p)
+            self.assertEqual(S256Point.parse(sec), 3 * G)
+            info = S256Point.parse_cache.info()
+            self.assertEqual((info.hits, info.misses, info.currsize), (2, 4, 2))
+            # キャッシュで共有される点の座標も変更できない
+            p = S256Point.parse(sec)
+            with self.assertRaises(AttributeError):
+                p.x.num = 5
+            with self.assertRaises(AttributeError):
+                S256Field(1).num = 2
+            self.assertEqual(S256Point.parse(sec), 3 * G)
+        finally:
+            S256Point.parse_cache = saved
+
+    def test_memoized_address(self):
+        p = 0x12345deadbeef * G
+        self.assertFalse(p._is_normalized())
+        address = p.address()
+        self.assertEqual(address, '1F1Pn2y6pDb68E5nYJJeba4TLg2U7B6KF1')
+        self.assertIs(p.address(), address)
+        self.assertIs(p.sec(), p.sec(True))
+        self.assertNotEqual(p.address(testnet=True), address)
+        self.assertNotEqual(p.hash160(compressed=False), p.hash160())
+        self.assertEqual(p.address(compressed=False), S256Point(p.x, p.y).address(False))
+        self.assertEqual(len(p._memo()), 7)
+        with self.assertRaises(AttributeError):
+            p.x = G.x
+        with self.assertRaises(AttributeError):
+            p._jacobian = G._jacobian
+
+    def test_jacobian_infinity(self):
+        inf = S256Point(None, None)
+        self.assertEqual(N * G, inf)
+        self.assertIsNone((N * G).x)
+        self.assertEqual(G + inf, G)
+        self.assertEqual((N - 1) * G + G, inf)
+
+    def test_generator_table(self):
+        for window in (1, 3, 4, 5):
+            table = GeneratorTable(window)
+            self.assertEqual(len(table.points), table.rows * ((1 << window) - 1))
+            for k in (1, 2, 15, 16, 0xdeadbeef, N - 1, 2 ** 255 + 12345):
+                expected = G.multiply(k)
+                self.assertEqual(S256Point._from_jacobian(table.multiply(k)), expected)
+            self.assertEqual(table.multiply(N)[2], 0)
+
+    def test_generator_table_buffer(self):
+        table = GeneratorTable(3)
+        data = table.to_bytes()
+        self.assertEqual(len(data), GeneratorTable.HEADER.size + 64 * len(table.points))
+        shared = GeneratorTable.from_buffer(bytearray(data))
+        self.assertIsInstance(shared.points, _BufferPoints)
+        self.assertEqual(shared.window, 3)
+        self.assertEqual(list(shared.points[i] for i in range(len(shared.points))), table.points)
+        # 2 回目からは変換済みの点を返す
+        self.assertIs(shared.points[5], shared.points[5])
+        for k in (1, 7, 0xdeadbeef, N - 1):
+            self.assertEqual(shared.multiply(k), table.multiply(k))
+        with self.assertRaises(ValueError):
+            GeneratorTable.from_buffer(b'X256' + data[4:])
+        with self.assertRaises(ValueError):
+            GeneratorTable.from_buffer(data[:-64])
+        with self.assertRaises(ValueError):
+            GeneratorTable.from_buffer(data[:3])
+
+    def test_attach_generator_table(self):
+        saved = GENERATOR_WINDOW
+        try:
+            table = attach_generator_table(GeneratorTable(5).to_bytes())
+            self.assertIs(generator_table(), table)
+            self.assertEqual(GENERATOR_WINDOW, 5)
+            self.assertEqual(0xabcdef * G, G.multiply(0xabcdef))
+        finally:
+            set_generator_window(saved)
+
+    def test_load_generator_table(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, 'g.tbl')
+            table = load_generator_table(path, 3)
+            self.assertTrue(os.path.exists(path))
+            self.assertEqual(table.multiply(0xdeadbeef), GeneratorTable(3).multiply(0xdeadbeef))
+            mtime = os.stat(path).st_mtime_ns
+            self.assertEqual(load_generator_table(path, 3).window, 3)
+            self.assertEqual(os.stat(path).st_mtime_ns, mtime)
+            # 壊れたファイルや window の違うファイルは作り直す
+            with open(path, 'r+b') as f:
+                f.seek(100)
+                f.write(b'\xff\xff')
+            with self.assertRaises(ValueError):
+                _map_generator_table(path)
+            self.assertEqual(load_generator_table(path, 3).multiply(5), table.multiply(5))
+            self.assertEqual(load_generator_table(path, 2).window, 2)
+            open(path, 'wb').close()
+            self.assertEqual(load_generator_table(path, 2).window, 2)
+            self.assertEqual(os.listdir(tmpdir), ['g.tbl'])
+
+    def test_backends(self):
+        saved = backend.BACKEND
+        key = PrivateKey(0xdeadbeef12345)
+        z = int.from_bytes(hash256(b'backend'), 'big')
+        expected = key.sign(z)
+        sec = key.point.sec()
+        try:
+            for name in backend.available():
+                backend.set_backend(name)
+                # テーブルの点の型を合わせるため作り直す
+                set_generator_window(GENERATOR_WINDOW)
+                sig = key.sign(z)
+                self.assertEqual((sig.r, sig.s), (expected.r, expected.s))
+                point = S256Point._parse(sec)
+                self.assertEqual(point, key.point)
+                self.assertTrue(point.verify(z, sig))
+                self.assertFalse(point.verify(z + 1, sig))
+                self.assertEqual((0xabcdef * point).sec(), PrivateKey(0xabcdef * key.secret % N).point.sec())
+                self.assertIs(type(point.x.num), int)
+        finally:
+            backend.set_backend(saved)
+            set_generator_window(GENERATOR_WINDOW)
+
+    def test_configure(self):
+        saved = current_config()
+        try:
+            config = configure(override='backend=python, window=3, glv=1')
+            self.assertEqual(config, {'backend': 'python', 'window': 3, 'glv': True})
+            self.assertEqual(S256Point.window, 3)
+            self.assertEqual(0xabcdef * G + G, 0xabcdf0 * G)
+            with tempfile.TemporaryDirectory() as tmpdir:
+                path = os.path.join(tmpdir, 'calibration.json')
+                config = configure(override='', path=path)
+                self.assertIn(config['backend'], backend.available())
+                self.assertEqual(_load_calibration(path), config)
+                # 保存した設定は測定せずにそのまま使う
+                _save_calibration(path, dict(config, window=2, glv=False))
+                self.assertEqual(configure(override='', path=path)['window'], 2)
+                with open(path, 'w') as f:
+                    f.write('{"backend": "python"')
+                self.assertIsNone(_load_calibration(path))
+                for bad in ({'window': '5'}, {'window': True}, {'window': 0},
+                            {'glv': 1}, {'backend': ['python']}):
+                    _save_calibration(path, dict(config, **bad))
+                    self.assertIsNone(_load_calibration(path))
+                # 読めない設定は測定し直して保存し直す
+                self.assertEqual(configure(override='', path=path), _load_calibration(path))
+        finally:
+            apply_config(saved)
+        self.assertEqual(parse_config('window=4,glv=false'), {'window': 4, 'glv': False})
+        with self.assertRaises(ValueError):
+            parse_config('speed=fast')
+        with self.assertRaises(ValueError):
+            parse_config('glv=maybe')
+        with self.assertRaises(ValueError):
+            apply_config({'backend': 'unknown'})
+        with self.assertRaises(ValueError):
+            apply_config({'window': 0})
+
+    def test_configure_error(self):
+        global _configured
+        saved = current_config()
+        saved_configured = _configured
+        try:
+            # 不正な ECC_CONFIG は最初の 1 回だけでなく毎回例外になる
+            _configured = False
+            for override in ('window=0', 'backend=nope', 'window=0', 'backend=nope'):
+                with self.assertRaises(ValueError):
+                    configure(override=override)
+                self.assertFalse(_configured)
+            self.assertEqual(current_config(), saved)
+        finally:
+            _configured = saved_configured
+            apply_config(saved)
+
+    def test_attach_generator_table_config(self):
+        global _configured, CONFIG_OVERRIDE
+        saved = current_config()
+        saved_window = GENERATOR_WINDOW
+        saved_override = CONFIG_OVERRIDE
+        other = [name for name in backend.available() if name != backend.BACKEND][0]
+        try:
+            # 最初の乗算の前に ECC_CONFIG でバックエンドが変わる場合
+            _configured = False
+            CONFIG_OVERRIDE = f'backend={other}'
+            table = attach_generator_table(GeneratorTable(3).to_bytes())
+            self.assertEqual(backend.BACKEND, other)
+            PrivateKey(12345).sign(67890)
+            self.assertIs(generator_table(), table)
+            # 後からバックエンドを変えてもバッファ上のテーブルは残る
+            apply_config({'backend': saved['backend']})
+            self.assertIs(generator_table().points._buffer, table.points._buffer)
+            self.assertEqual(0xabcdef * G, G.multiply(0xabcdef))
+            self.assertIsInstance(generator_table().points[0][0], type(backend.mpz(1)))
+        finally:
+            CONFIG_OVERRIDE = saved_override
+            apply_config(saved)
+            set_generator_window(saved_window)
+
+    def test_set_generator_window(self):
+        saved = GENERATOR_WINDOW
+        try:
+            set_generator_window(6)
+            self.assertEqual(generator_table().window, 6)
+            self.assertEqual(1234567 * G, G.multiply(1234567))
+        finally:
+            set_generator_window(saved)
+        with self.assertRaises(ValueError):
+            set_generator_window(0)
+
+    def test_generator_table_threads(self):
+        saved = GENERATOR_WINDOW
+        try:
+            set_generator_window(3)
+            tables = []
+            threads = [threading.Thread(target=lambda: tables.append(generator_table()))
+                       for _ in range(4)]
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
+            # テーブルは 1 度だけ作られ, 全てのスレッドが同じものを使う
+            self.assertEqual(len(tables), 4)
+            self.assertTrue(all(table is tables[0] for table in tables))
+        finally:
+            set_generator_window(saved)
+
+    def test_mul_add(self):
+        point = 0xdeadbeef * G
+        for u, v in ((0, 0), (1, 0), (0, 1), (3, 5), (N - 1, 2 ** 200 + 7),
+                     (0x1234567890abcdef, N - 2)):
+            self.assertEqual(S256Point.mul_add(u, v, point), u * G + v * point)
+        self.assertEqual(S256Point.mul_add(1, N - 1, G), S256Point(None, None))
+        saved = GENERATOR_WINDOW
+        try:
+            set_generator_window(3)
+            self.assertEqual(S256Point.mul_add(N - 1, 2 ** 200 + 7, point), (N - 1) * G + (2 ** 200 + 7) * point)
+        finally:
+            set_generator_window(saved)
+
+    def test_wnaf_terms(self):
+        for window in (1, 3, 4):
+            table = GeneratorTable(window)
+            for k in (0, 1, 0xdeadbeef, N - 1, 2 ** 255 + 12345):
+                for bits in (0, 5, 129, 256):
+                    terms = table.wnaf_terms(k, bits)
+                    self.assertEqual(S256Point._from_jacobian(jacobian_strauss([], 2, terms)), k * G)
+        table = GeneratorTable.from_buffer(GeneratorTable(4).to_bytes())
+        self.assertEqual(table.odd_multiples(1), GeneratorTable(4).odd_multiples(1))
+        self.assertEqual(len(table.odd_multiples(0)[0]), 8)
+
+    def test_multi_scalar_mul(self):
+        points = [PrivateKey(i + 1).point for i in range(12)] + [S256Point(None, None)]
+        scalars = [randint(0, N - 1) for _ in points[:-4]] + [0, N + 5, 3, 7]
+        expected = S256Point(None, None)
+        for k, point in zip(scalars, points):
+            expected = expected + k * point
+        saved = S256Point.pippenger_threshold
+        try:
+            for threshold in (1, 1000):
+                S256Point.pippenger_threshold = threshold
+                self.assertEqual(S256Point.multi_scalar_mul(scalars, points), expected)
+                S256Point.glv = True
+                try:
+                    self.assertEqual(S256Point.multi_scalar_mul(scalars, points), expected)
+                finally:
+                    S256Point.glv = False
+        finally:
+            S256Point.pippenger_threshold = saved
+        self.assertEqual(S256Point.multi_scalar_mul([3], [G]), 3 * G)
+        self.assertEqual(S256Point.multi_scalar_mul([1, N - 1], [G, G]), S256Point(None, None))
+        self.assertEqual(S256Point.multi_scalar_mul([], []), S256Point(None, None))
+        with self.assertRaises(ValueError):
+            S256Point.multi_scalar_mul([1, 2], [G])
+
+    def test_glv_split(self):
+        for k in (0, 1, LAMBDA, N - 1, 2 ** 128, 0xdeadbeef * 2 ** 100 + 12345):
+            k1, k2 = glv_split(k)
+            self.assertEqual((k1 + k2 * LAMBDA) % N, k)
+            self.assertLessEqual(abs(k1).bit_length(), 129)
+            self.assertLessEqual(abs(k2).bit_length(), 129)
+        self.assertEqual(LAMBDA * G, S256Point(BETA * G.x.num % P, G.y.num))
+
+    def test_glv_multiply(self):
+        point = 0x1234567 * G
+        scalars = [1, 2, LAMBDA, N - 1, N - LAMBDA, 2 ** 255 + 99] \
+            + [randint(1, N - 1) for _ in range(10)]
+        for k in scalars:
+            expected = point.multiply(k)
+            for window in (1, 2, 4, 5):
+                self.assertEqual(point.multiply(k, window, glv=True), expected)
+        self.assertEqual(point.multiply(N, glv=True), S256Point(None, None))
+
+    def test_glv_mode(self):
+        point = 0xabcdef * G
+        u, v = randint(1, N - 1), randint(1, N - 1)
+        expected_mul = v * point
+        expected_add = S256Point.mul_add(u, v, point)
+        saved = S256Point.window
+        S256Point.glv = True
+        try:
+            self.assertEqual(v * point, expected_mul)
+            self.assertEqual(S256Point.mul_add(u, v, point), expected_add)
+            self.assertEqual(S256Point.mul_add(1, N - 1, G), S256Point(None, None))
+            self.test_s256point_verify_3()
+            # wNAF の窓幅は 2 以上なので, window = 1 でも GLV では 2 として計算する
+            S256Point.window = 1
+            self.assertEqual(S256Point.mul_add(u, v, point), expected_add)
+            self.test_s256point_verify_3()
+        finally:
+            S256Point.glv = False
+            S256Point.window = saved
+
 class Signature:
 
+    __slots__ = ('r', 's')
+
     def __init__(self, r, s):
         self.r = r
         self.s = s
@@ -447,6 +1781,29 @@ class Signature:
         result += bytes([2, len(sbin)]) + sbin
         return bytes([0x30, len(result)]) + result
 
+    @classmethod
+    def parse(cls, signature_bin):
+        '''DER 形式のバイナリから Signature を返す'''
+        if len(signature_bin) < 2 or signature_bin[0] != 0x30:
+            raise ValueError('Bad Signature')
+        if signature_bin[1] + 2 != len(signature_bin):
+            raise ValueError('Bad Signature Length')
+        values = []
+        i = 2
+        for _ in range(2):
+            # 0x02 (整数), 長さ, 値 の順に r, s が並ぶ
+            if i + 2 > len(signature_bin) or signature_bin[i] != 0x02:
+                raise ValueError('Bad Signature')
+            length = signature_bin[i + 1]
+            i += 2
+            if i + length > len(signature_bin):
+                raise ValueError('Bad Signature Length')
+            values.append(int.from_bytes(signature_bin[i:i + length], 'big'))
+            i += length
+        if i != len(signature_bin):
+            raise ValueError('Signature too long')
+        return cls(*values)
+
 class TestSignature(unittest.TestCase):
 
     def test_der(self):
@@ -456,11 +1813,41 @@ class TestSignature(unittest.TestCase):
         sig = Signature(r=r, s=s)
         #print(sig.der().hex())
 
+    def test_parse(self):
+        for r, s in ((1, 2), (0x80, 0xff00), (N - 1, N // 2),
+                     (0x37206a0610995c58074999cb9767b87af4c4978db68c06e8e6e81d282047a7c6,
+                      0x8ca63759c1157ebeaec0d03cecca119fc9a75bf8e6d0fa65c841c8e2738cdaec)):
+            sig = Signature.parse(Signature(r, s).der())
+            self.assertEqual((sig.r, sig.s), (r, s))
+        der = Signature(1, 2).der()
+        for bad in (b'', b'\x31' + der[1:], der[:-1], der + b'\x00', der[:2] + b'\x03' + der[3:]):
+            with self.assertRaises(ValueError):
+                Signature.parse(bad)
+
 class PrivateKey:
 
     def __init__(self, secret):
         self.secret = secret
-        self.point = secret * G
+        self._point = None
+
+    @property
+    def point(self):
+        '''公開鍵. 最初に参照されたときに計算する'''
+        if self._point is None:
+            self._point = self.secret * G
+        return self._point
+
+    @classmethod
+    def from_secrets(cls, secrets):
+        '''複数の秘密鍵をまとめて作る
+
+        公開鍵も計算し, アフィン座標は batch_normalize で 1 回の逆元計算にまとめる.
+        '''
+        keys = [cls(secret) for secret in secrets]
+        points = batch_normalize([key.secret * G for key in keys])
+        for key, point in zip(keys, points):
+            key._point = point
+        return keys
 
     def hex(self):
         return f'{self.secret:064x}'
@@ -469,7 +1856,7 @@ class PrivateKey:
         #k = randint(0, N-1)
         k = self.deterministic_k(z)
         r = (k*G).x.num
-        k_inv = pow(k, N-2, N)
+        k_inv = backend.invert(k, N)
         s = (z + r*self.secret) * k_inv % N
         if s > N/2:
             s = N - s
@@ -507,6 +1894,23 @@ class PrivateKey:
             suffix = b''
         return encode_base58_checksum(prefix + secret_bytes + suffix)
 
+def sign_batch(items):
+    '''(PrivateKey, z) の組をまとめて署名し, Signature のリストを返す
+
+    k * G のアフィン座標と k の逆元は, それぞれ 1 回の逆元計算でまとめて求める.
+    '''
+    ks = [key.deterministic_k(z) for key, z in items]
+    table = generator_table()
+    points = jacobian_batch_to_affine([table.multiply(k) for k in ks])
+    k_invs = batch_inverse_mod(ks, N)
+    result = []
+    for (key, z), (r, _), k_inv in zip(items, points, k_invs):
+        s = (z + r * key.secret) * k_inv % N
+        if s > N/2:
+            s = N - s
+        result.append(Signature(r, s))
+    return result
+
 class TestPrivateKey(unittest.TestCase):
 
     def test_to_sec_format(self):
@@ -528,6 +1932,72 @@ class TestPrivateKey(unittest.TestCase):
         address = key.point.address()
         self.assertEqual(address, '1F1Pn2y6pDb68E5nYJJeba4TLg2U7B6KF1')
 
+    def test_lazy_point(self):
+        key = PrivateKey(5002)
+        self.assertIsNone(key._point)
+        key.sign(1234)
+        key.wif()
+        self.assertIsNone(key._point)
+        point = key.point
+        self.assertIs(key.point, point)
+        self.assertEqual(point, 5002 * G)
+
+    def test_derive_range(self):
+        start = 0x12345deadbeef - 3
+        results = list(derive_range(start, 7, chunk=3))
+        self.assertEqual([r[0] for r in results], list(range(start, start + 7)))
+        self.assertEqual(results[3][2], '1F1Pn2y6pDb68E5nYJJeba4TLg2U7B6KF1')
+        for secret, sec, address in results:
+            point = PrivateKey(secret).point
+            self.assertEqual(sec, point.sec())
+            self.assertEqual(address, point.address())
+        secret, sec, address = next(derive_range(5002, 1, compressed=False, testnet=True))
+        self.assertEqual(address, 'mmTPbXQFxboEtNRkwfh6K51jvdtHLxGeMA')
+        self.assertEqual(len(sec), 65)
+        self.assertEqual(len(list(derive_range(N - 2, 2))), 2)
+        self.assertEqual(list(derive_range(1, 0)), [])
+        with self.assertRaises(ValueError):
+            next(derive_range(N - 1, 2))
+        with self.assertRaises(ValueError):
+            next(derive_range(0, 1))
+
+    def test_derive_range_vectorized(self):
+        if not fieldvec.available():
+            self.skipTest('numpy is not installed')
+        saved = fieldvec.RANGE_CHUNK, fieldvec.MIN_BATCH
+        fieldvec.RANGE_CHUNK, fieldvec.MIN_BATCH = 200, 100
+        try:
+            # 1 から始めると base = ±i * G となり整数の計算に切り替わる.
+            # 最後の 50 個は MIN_BATCH より少ないので整数で計算する
+            for start in (1, 0x12345deadbeef):
+                count = 2 * fieldvec.RANGE_CHUNK + 50
+                coords = [xy for chunk in _vectorized_range(start, count) for xy in chunk]
+                expected = [xy for chunk in _sequential_range(start, count, 256) for xy in chunk]
+                self.assertEqual(coords, expected)
+                results = list(derive_range(start, count))
+                self.assertEqual(results[-1][1], PrivateKey(start + count - 1).point.sec())
+        finally:
+            fieldvec.RANGE_CHUNK, fieldvec.MIN_BATCH = saved
+
+    def test_from_secrets(self):
+        secrets = [5002, 2020 ** 5, 0x12345deadbeef, 1]
+        keys = PrivateKey.from_secrets(secrets)
+        self.assertEqual([key.secret for key in keys], secrets)
+        for key in keys:
+            self.assertTrue(key._point._is_normalized())
+            self.assertEqual(key.point, PrivateKey(key.secret).point)
+        self.assertEqual(keys[2].point.address(), '1F1Pn2y6pDb68E5nYJJeba4TLg2U7B6KF1')
+        self.assertEqual(PrivateKey.from_secrets([]), [])
+
+    def test_sign_batch(self):
+        keys = [PrivateKey(5003), PrivateKey(2021 ** 5), PrivateKey(5003)]
+        items = [(keys[0], 1), (keys[1], 0xdeadbeef), (keys[2], N + 5)]
+        for (key, z), sig in zip(items, sign_batch(items)):
+            expected = key.sign(z)
+            self.assertEqual((sig.r, sig.s), (expected.r, expected.s))
+            self.assertTrue(key.point.verify(z, sig))
+        self.assertEqual(sign_batch([]), [])
+
     def test_wif_1(self):
         key = PrivateKey(5003)
         wif = key.wif(testnet=True)
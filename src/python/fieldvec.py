@@ -0,0 +1,294 @@
+#!/usr/bin/env python3
+""" NumPy による secp256k1 の有限体の要素の一括演算モジュール
+
+要素の配列を 26 ビットずつ 10 個の limb に分け, 形が (10, n) の int64 の配列で表す.
+(i 行目が全ての要素の 2^(26*i) の桁. 行ごとの演算がベクトル化される)
+limb の積は 52 ビット, その 10 個の和も 56 ビットに収まるので, 繰り上がりは最後にまとめて行う.
+2^260 = 2^36 + 15632 (mod P) なので, 2^260 以上の桁はこれを掛けて下位に畳み込んで還元する.
+演算結果は 2^260 未満まで還元するだけで, P 未満にするのは from_limbs() で int に戻すときに行う.
+
+NumPy は import ecc を遅くしないよう, 最初に available() か enabled() が呼ばれたときに読み込む.
+インストールされていない場合, available() が False になり ecc.py は整数での計算を使う.
+"""
+
+import unittest
+from random import randint
+import backend
+from secp256k1 import P, GX, GY, jacobian_add_affine, jacobian_double, jacobian_batch_to_affine, \
+    jacobian_multiply
+
+# available() が読み込むまでは None. _SUB_OFFSET と _ONE は NumPy の配列の定数
+np = None
+_SUB_OFFSET = _ONE = None
+_numpy_loaded = False
+
+LIMBS = 10
+LIMB_BITS = 26
+MASK = (1 << LIMB_BITS) - 1
+# 2^260 = 2^26 * 2^10 + 15632 (mod P)
+_FOLD_LOW = 15632
+_FOLD_HIGH_SHIFT = 10
+# これより少ない要素は整数で計算した方が速い
+MIN_BATCH = 512
+# affine_range() で 1 度に計算する点の数
+RANGE_CHUNK = 4096
+
+def available():
+    '''NumPy が使えるか. 最初に呼ばれたときに NumPy を読み込む'''
+    if not _numpy_loaded:
+        _load_numpy()
+    return np is not None
+
+def enabled(count):
+    '''count 個の要素の一括演算に NumPy を使うか'''
+    return count >= MIN_BATCH and available()
+
+def _load_numpy():
+    global np, _numpy_loaded, _SUB_OFFSET, _ONE
+    try:
+        import numpy
+    except ImportError:
+        numpy = None
+    if numpy is not None:
+        # 128P の limb 表現で, 上の limb から 4 ずつ借りて下の limb を全て 2^28 以上にしたもの
+        _SUB_OFFSET = numpy.array([[(128 * P >> (LIMB_BITS * i)) & MASK] for i in range(LIMBS - 1)]
+                                  + [[128 * P >> (LIMB_BITS * (LIMBS - 1))]], numpy.int64)
+        _SUB_OFFSET[:-1] += 4 << LIMB_BITS
+        _SUB_OFFSET[1:] -= 4
+        _ONE = numpy.zeros((LIMBS, 1), numpy.int64)
+        _ONE[0] = 1
+    # 他のスレッドが np を見たときには定数が揃っているよう, 最後に設定する
+    np = numpy
+    _numpy_loaded = True
+
+def to_limbs(values):
+    '''0 以上 2^256 未満の int のリストを (10, n) の limb の配列にする'''
+    data = b''.join(value.to_bytes(32, 'little') for value in values)
+    words = np.frombuffer(data, dtype='<u8').reshape(len(values), 4).T
+    words = np.concatenate([words, np.zeros((1, len(values)), np.uint64)])
+    limbs = np.empty((LIMBS, len(values)), np.int64)
+    for i in range(LIMBS):
+        w, offset = divmod(LIMB_BITS * i, 64)
+        limb = words[w] >> np.uint64(offset)
+        if offset + LIMB_BITS > 64:
+            limb |= words[w + 1] << np.uint64(64 - offset)
+        limbs[i] = limb & np.uint64(MASK)
+    return limbs
+
+def from_limbs(limbs):
+    '''reduce() 済みの limb の配列を 0 以上 P 未満の int のリストに戻す'''
+    limbs = np.concatenate([limbs, np.zeros((1, limbs.shape[1]), np.int64)])
+    # 各 limb を 26 ビットに収めてから 64 ビットの語に詰める
+    for i in range(LIMBS):
+        limbs[i + 1] += limbs[i] >> LIMB_BITS
+        limbs[i] &= MASK
+    limbs = limbs.astype(np.uint64)
+    words = np.zeros((5, limbs.shape[1]), np.uint64)
+    for i in range(LIMBS + 1):
+        w, offset = divmod(LIMB_BITS * i, 64)
+        words[w] |= limbs[i] << np.uint64(offset)
+        if offset + LIMB_BITS > 64:
+            words[w + 1] |= limbs[i] >> np.uint64(64 - offset)
+    data = words.T.astype('<u8').tobytes()
+    return [int.from_bytes(data[i:i + 40], 'little') % P for i in range(0, len(data), 40)]
+
+def _carry(t, rounds=2):
+    '''全ての行の繰り上がりを同時に 1 つ上の行に送る. 最上位の行はそのまま残す
+
+    1 回ごとに各行は 26 ビットと上の行からの繰り上がり程度の大きさになる.
+    '''
+    for _ in range(rounds):
+        carry = t[:-1] >> LIMB_BITS
+        t[:-1] &= MASK
+        t[1:] += carry
+    return t
+
+def _fold(t, high):
+    '''2^260 以上の桁 high (t の上の行) に 2^36 + 15632 を掛けて t の下位に足す'''
+    h = len(high)
+    t[:h] += high * _FOLD_LOW
+    t[1:h + 1] += high << _FOLD_HIGH_SHIFT
+
+def reduce(t):
+    '''(m, n) の配列 (各行は 0 以上 2^58 未満, m は 20 以下) を mod P で 2^260 程度までの (10, n) にする
+
+    結果の各 limb は 2^27 未満になるので, そのまま mul() などに渡せる.
+    '''
+    n = t.shape[1]
+    t = np.concatenate([t, np.zeros((2 * LIMBS - len(t), n), np.int64)]) \
+        if len(t) < 2 * LIMBS else t.copy()
+    _carry(t)
+    low = np.zeros((LIMBS + 1, n), np.int64)
+    low[:LIMBS] = t[:LIMBS]
+    _fold(low, t[LIMBS:])
+    _carry(low)
+    # 2^260 以上に残った 1 行をもう一度畳み込む
+    result = low[:LIMBS]
+    _fold(result, low[LIMBS:])
+    return _carry(result)
+
+def add(a, b):
+    '''a + b (mod P)'''
+    return reduce(a + b)
+
+def sub(a, b):
+    '''a - b (mod P)'''
+    # 全ての limb が b の limb より大きい P の倍数を足して, limb ごとに負にならないようにする
+    return reduce(a - b + _SUB_OFFSET)
+
+def mul(a, b):
+    '''a * b (mod P)'''
+    t = np.zeros((2 * LIMBS, a.shape[1]), np.int64)
+    for i in range(LIMBS):
+        t[i:i + LIMBS] += a[i] * b
+    return reduce(t)
+
+def batch_inverse(a):
+    '''全ての要素の逆元を 1 回の逆元計算で求める. 0 を含んではいけない
+
+    2 個ずつの積を木にして根の逆元を求め, 葉に向かって各要素の逆元に分ける.
+    どの段もベクトル化された乗算になる.
+    '''
+    levels = []
+    level = a
+    while level.shape[1] > 1:
+        if level.shape[1] % 2:
+            level = np.concatenate([level, _ONE], axis=1)
+        levels.append(level)
+        level = mul(level[:, 0::2], level[:, 1::2])
+    root, = from_limbs(level)
+    inverse = to_limbs([backend.invert(root, P)])
+    for level in reversed(levels):
+        # 上の段で 1 を補った列の分を除く
+        inverse = inverse[:, :level.shape[1] // 2]
+        # 組 (l, r) の逆元は 1/l = r/(lr), 1/r = l/(lr)
+        result = np.empty_like(level)
+        result[:, 0::2] = mul(inverse, level[:, 1::2])
+        result[:, 1::2] = mul(inverse, level[:, 0::2])
+        inverse = result
+    return inverse[:, :a.shape[1]]
+
+def add_affine(x1, y1, x2, y2):
+    '''アフィン座標の点の配列同士を加算する. x1 != x2 (P1 != ±P2) であること'''
+    slope = mul(sub(y2, y1), batch_inverse(sub(x2, x1)))
+    x3 = sub(sub(mul(slope, slope), x1), x2)
+    y3 = sub(mul(slope, sub(x1, x3)), y1)
+    return x3, y3
+
+# G, 2G, ..., (RANGE_CHUNK - 1) * G のアフィン座標 (x から添字への辞書, x の limb, y の limb)
+_g_multiples = None
+
+def _multiples_of_g(count):
+    '''G, 2G, ..., count * G のアフィン座標の表. 表は 1 つだけ作り, 先頭の count 列を切り出す'''
+    global _g_multiples
+    table = _g_multiples
+    if table is None or table[1].shape[1] < count:
+        g = (GX, GY)
+        points = [(GX, GY, 1)]
+        for _ in range(max(count, RANGE_CHUNK - 1) - 1):
+            points.append(jacobian_add_affine(points[-1], g))
+        affine = jacobian_batch_to_affine(points)
+        xs = [x for x, _ in affine]
+        table = ({x: i for i, x in enumerate(xs)}, to_limbs(xs), to_limbs([y for _, y in affine]))
+        _g_multiples = table
+    index, mx, my = table
+    return index, mx[:, :count], my[:, :count]
+
+def affine_range(base, count):
+    '''アフィン座標の点 base について base, base + G, ..., base + (count - 1) * G を返す
+
+    base + i * G をまとめて add_affine() で計算する. base が ±i * G のときは None を返すので,
+    呼び出し側で整数の計算に切り替えること.
+    '''
+    if count < 2:
+        return None
+    index, mx, my = _multiples_of_g(count - 1)
+    if index.get(base[0], count) < count - 1:
+        return None
+    x1 = np.repeat(to_limbs([base[0]]), count - 1, axis=1)
+    y1 = np.repeat(to_limbs([base[1]]), count - 1, axis=1)
+    x3, y3 = add_affine(x1, y1, mx, my)
+    return [base] + list(zip(from_limbs(x3), from_limbs(y3)))
+
+class TestFieldVec(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        if not available():
+            raise unittest.SkipTest('numpy is not installed')
+
+    def values(self, n=37):
+        values = [randint(0, P - 1) for _ in range(n)]
+        return values + [0, 1, P - 1, P - 2, 2 ** 256 - P, MASK, 2 ** 255]
+
+    def test_limbs(self):
+        values = self.values()
+        limbs = to_limbs(values)
+        self.assertEqual(limbs.shape, (LIMBS, len(values)))
+        self.assertEqual(from_limbs(limbs), values)
+
+    def test_arithmetic(self):
+        a = self.values()
+        b = list(reversed(self.values()))
+        la, lb = to_limbs(a), to_limbs(b)
+        self.assertEqual(from_limbs(add(la, lb)), [(x + y) % P for x, y in zip(a, b)])
+        self.assertEqual(from_limbs(sub(la, lb)), [(x - y) % P for x, y in zip(a, b)])
+        self.assertEqual(from_limbs(mul(la, lb)), [x * y % P for x, y in zip(a, b)])
+        self.assertEqual(from_limbs(mul(la, la)), [x * x % P for x in a])
+
+    def test_reduce(self):
+        # 全ての limb が最大の 520 ビットの値
+        t = np.full((2 * LIMBS, 3), MASK, np.int64)
+        t[:, 1] = 0
+        t[:LIMBS, 2] = to_limbs([P])[:, 0]
+        t[LIMBS:, 2] = 0
+        result = reduce(t)
+        self.assertEqual(from_limbs(result), [(2 ** (2 * LIMBS * LIMB_BITS) - 1) % P, 0, 0])
+        self.assertTrue(((result >= 0) & (result < 2 ** (LIMB_BITS + 1))).all())
+        # limb が上限に近い値同士の演算でも結果の limb は上限を超えない
+        a = np.full((LIMBS, 2), 2 ** (LIMB_BITS + 1) - 1, np.int64)
+        a[:, 1] = 0
+        value = sum((2 ** (LIMB_BITS + 1) - 1) << (LIMB_BITS * i) for i in range(LIMBS))
+        for result, expected in ((mul(a, a), [value * value % P, 0]),
+                                 (sub(a[:, ::-1], a), [-value % P, value % P]),
+                                 (add(a, a), [2 * value % P, 0])):
+            self.assertEqual(from_limbs(result), expected)
+            self.assertTrue(((result >= 0) & (result < 2 ** (LIMB_BITS + 1))).all())
+
+    def test_batch_inverse(self):
+        values = [v for v in self.values(100) if v]
+        inverses = from_limbs(batch_inverse(to_limbs(values)))
+        for value, inverse in zip(values, inverses):
+            self.assertEqual(value * inverse % P, 1)
+        self.assertEqual(from_limbs(batch_inverse(to_limbs([5]))), [pow(5, P - 2, P)])
+
+    def test_add_affine(self):
+        base = (GX, GY)
+        points = [(GX, GY, 1)]
+        for _ in range(10):
+            points.append(jacobian_add_affine(points[-1], base))
+        affine = jacobian_batch_to_affine(points[1:])
+        x2, y2 = (to_limbs([p[k] for p in affine]) for k in range(2))
+        x1, y1 = (to_limbs([v] * len(affine)) for v in base)
+        x3, y3 = add_affine(x1, y1, x2, y2)
+        expected = jacobian_batch_to_affine([jacobian_add_affine(p, base) for p in points[1:]])
+        self.assertEqual(list(zip(from_limbs(x3), from_limbs(y3))), expected)
+
+    def test_affine_range(self):
+        base = jacobian_batch_to_affine([jacobian_multiply((GX, GY, 1), 0xdeadbeef, 4)])[0]
+        points = [(base[0], base[1], 1)]
+        for _ in range(9):
+            points.append(jacobian_add_affine(points[-1], (GX, GY)))
+        self.assertEqual(affine_range(base, 10), jacobian_batch_to_affine(points))
+        # base = 2G のとき base + 2G の傾きの分母が 0 になる
+        double = jacobian_batch_to_affine([jacobian_double((GX, GY, 1))])[0]
+        self.assertIsNone(affine_range(double, 10))
+        self.assertIsNone(affine_range(base, 1))
+        # 表は count によらず 1 つで, 使う範囲より先の ±i * G は base にしてよい
+        table = _g_multiples
+        self.assertEqual(affine_range(base, 5), jacobian_batch_to_affine(points[:5]))
+        self.assertIs(_g_multiples, table)
+        self.assertIsNotNone(affine_range(double, 2))
+
+if __name__ == "__main__":
+    unittest.main()
@@ -4,6 +4,7 @@
 
 import unittest
 import hashlib
+import backend
 
 def hash256(s):
     '''two rounds of sha256'''
@@ -50,6 +51,80 @@ class TestEncode(unittest.TestCase):
         b = v.to_bytes(32, 'big')
         #print(encode_base58(b))
 
+def wnaf(coefficient, window):
+    '''非負整数を幅 window の NAF (下位桁から順) に変換する
+
+    各桁は 0 または絶対値が 2^(window-1) 未満の奇数で,
+    0 でない桁の間には必ず window - 1 個以上の 0 が入る.
+    '''
+    digits = []
+    for i, d in sparse_wnaf(coefficient, window):
+        digits.extend([0] * (i - len(digits)))
+        digits.append(d)
+    return digits
+
+def sparse_wnaf(coefficient, window):
+    '''wnaf() の 0 でない桁だけを (位置, 桁) のリストで返す. 0 の桁は 1 つずつ調べない'''
+    if window < 2:
+        raise ValueError(f'window {window} must be at least 2')
+    if coefficient < 0:
+        raise ValueError(f'coefficient {coefficient} must not be negative')
+    full = 1 << window
+    half = 1 << (window - 1)
+    result = []
+    i = 0
+    while coefficient:
+        # 下位の 0 の桁をまとめて飛ばす
+        zeros = (coefficient & -coefficient).bit_length() - 1
+        i += zeros
+        coefficient >>= zeros
+        d = coefficient & (full - 1)
+        if d >= half:
+            d -= full
+        result.append((i, d))
+        coefficient = (coefficient - d) >> 1
+        i += 1
+    return result
+
+def batch_inverse_mod(values, modulus):
+    '''Montgomery の方法で values の各要素の逆元を 1 回のべき乗でまとめて求める
+
+    0 を含んではいけない.
+    '''
+    prefix = []
+    acc = 1
+    for value in values:
+        prefix.append(acc)
+        acc = acc * value % modulus
+    inv = backend.invert(acc, modulus)
+    result = [0] * len(values)
+    for i in range(len(values) - 1, -1, -1):
+        result[i] = prefix[i] * inv % modulus
+        inv = inv * values[i] % modulus
+    return result
+
+class TestInteger(unittest.TestCase):
+
+    def test_wnaf(self):
+        for window in (2, 3, 4, 5):
+            for k in (0, 1, 7, 255, 0xdeadbeef, 2 ** 256 - 1):
+                digits = wnaf(k, window)
+                self.assertEqual(sum(d << i for i, d in enumerate(digits)), k)
+                nonzero = [i for i, d in enumerate(digits) if d]
+                for i, j in zip(nonzero, nonzero[1:]):
+                    self.assertGreaterEqual(j - i, window)
+                for d in digits:
+                    self.assertTrue(d == 0 or (d % 2 == 1 and abs(d) < 1 << (window - 1)))
+                self.assertEqual(sparse_wnaf(k, window), [(i, d) for i, d in enumerate(digits) if d])
+        with self.assertRaises(ValueError):
+            wnaf(5, 1)
+
+    def test_batch_inverse_mod(self):
+        values = [1, 2, 3, 2 ** 255 - 20, 0xdeadbeef]
+        for value, inv in zip(values, batch_inverse_mod(values, 2 ** 255 - 19)):
+            self.assertEqual(value * inv % (2 ** 255 - 19), 1)
+        self.assertEqual(batch_inverse_mod([], 2 ** 255 - 19), [])
+
 def little_endian_to_int(b):
     return int.from_bytes(b, 'little')
 
@@ -0,0 +1,335 @@
+#!/usr/bin/env python3
+""" 複数プロセスとスレッドによる並列処理モジュール
+
+GIL の無い CPython (3.13t など) ではスレッドでも検証が並列に進むので, VerifyThreadPool を使うと
+プロセス間通信の分だけ速くなる.
+"""
+
+import unittest
+import os
+from collections import deque
+from itertools import islice
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from multiprocessing import shared_memory
+from ecc import *
+
+def pack_record(secret, sec, address):
+    '''(秘密鍵, SEC, アドレス) をバイト列にする
+
+    秘密鍵 32 バイト, SEC (先頭バイトで 33 か 65 バイトか分かる), アドレスの長さ 1 バイト, アドレスの順.
+    '''
+    address = address.encode('ascii')
+    return secret.to_bytes(32, 'big') + sec + bytes([len(address)]) + address
+
+def unpack_records(data):
+    '''pack_record で作ったバイト列を連結したものから (秘密鍵, SEC, アドレス) を順に返す'''
+    i = 0
+    while i < len(data):
+        secret = int.from_bytes(data[i:i + 32], 'big')
+        i += 32
+        sec_len = 65 if data[i] == 4 else 33
+        sec = data[i:i + sec_len]
+        i += sec_len
+        address_len = data[i]
+        address = data[i + 1:i + 1 + address_len].decode('ascii')
+        i += 1 + address_len
+        yield secret, sec, address
+
+def share_generator_table(window=None):
+    '''G のテーブルを共有メモリに置いて SharedMemory を返す
+
+    使い終わったら close() と unlink() を呼ぶこと.
+    '''
+    if window is None:
+        window = GENERATOR_WINDOW
+    data = GeneratorTable(window).to_bytes()
+    shm = shared_memory.SharedMemory(create=True, size=len(data))
+    shm.buf[:len(data)] = data
+    return shm
+
+# ワーカーが接続した共有メモリ. テーブルが参照している間は閉じない
+_worker_shm = None
+
+def _init_worker(window, shm_name=None):
+    global _worker_shm
+    if shm_name is None:
+        # G のテーブルを最初のタスクの前に作っておく
+        set_generator_window(window)
+        generator_table()
+    else:
+        _worker_shm = shared_memory.SharedMemory(name=shm_name)
+        attach_generator_table(_worker_shm.buf)
+
+def _derive_task(start_secret, count, compressed, testnet):
+    results = derive_range(start_secret, count, compressed, testnet)
+    return b''.join(pack_record(*r) for r in results)
+
+def _secrets_task(secrets, compressed, testnet):
+    keys = PrivateKey.from_secrets(secrets)
+    return b''.join(pack_record(key.secret, key.point.sec(compressed),
+                                key.point.address(compressed, testnet)) for key in keys)
+
+class _WorkerPool:
+    """G のテーブルを用意したワーカープロセスのプール
+
+    shared が True ならテーブルは 1 度だけ作って共有メモリに置き, 全てのワーカーがそれを使う.
+    """
+
+    def __init__(self, workers=None, window=None, shared=True):
+        self.workers = workers or os.cpu_count()
+        if window is None:
+            window = GENERATOR_WINDOW
+        self._shm = share_generator_table(window) if shared else None
+        initargs = (window, self._shm.name if shared else None)
+        self._executor = ProcessPoolExecutor(self.workers, initializer=_init_worker,
+                                             initargs=initargs)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        self._executor.shutdown()
+        if self._shm is not None:
+            self._shm.close()
+            self._shm.unlink()
+            self._shm = None
+
+class KeyPipeline(_WorkerPool):
+    """秘密鍵から SEC とアドレスを複数プロセスで生成する
+
+    鍵の範囲や秘密鍵のリストを chunk 個ずつのタスクに分けてワーカーに配る.
+    結果はワーカーから pack_record のバイト列で受け取り, 入力の順に返す.
+    実行中のタスクは workers * 4 個までに抑え, 結果を 1 つ返すごとに次のタスクを投げるので,
+    鍵の範囲が大きくてもメモリは chunk に比例する分しか使わない.
+    """
+
+    def __init__(self, workers=None, chunk=4096, window=None, shared=True):
+        super().__init__(workers, window, shared)
+        self.chunk = chunk
+
+    def __repr__(self):
+        return f'KeyPipeline(workers={self.workers}, chunk={self.chunk})'
+
+    def derive_range(self, start_secret, count, compressed=True, testnet=False):
+        '''ecc.derive_range と同じ結果を並列に計算する'''
+        if start_secret < 1 or count < 0 or start_secret + count > N:
+            raise ValueError(f'secrets {start_secret} .. {start_secret + count - 1} not in range 1 to {N - 1}')
+        end = start_secret + count
+        tasks = ((_derive_task, s, min(self.chunk, end - s), compressed, testnet)
+                 for s in range(start_secret, end, self.chunk))
+        for data in self._run(tasks):
+            yield from unpack_records(data)
+
+    def from_secrets(self, secrets, compressed=True, testnet=False):
+        '''秘密鍵のリストについて (秘密鍵, SEC, アドレス) を並列に計算する'''
+        secrets = iter(secrets)
+        chunks = iter(lambda: list(islice(secrets, self.chunk)), [])
+        tasks = ((_secrets_task, chunk, compressed, testnet) for chunk in chunks)
+        for data in self._run(tasks):
+            yield from unpack_records(data)
+
+    def _run(self, tasks):
+        '''(関数, 引数...) の tasks を実行中が workers * 4 個までになるように投げ, 結果を順に返す'''
+        pending = deque()
+        try:
+            for task in tasks:
+                if len(pending) >= self.workers * 4:
+                    yield pending.popleft().result()
+                pending.append(self._executor.submit(*task))
+            while pending:
+                yield pending.popleft().result()
+        finally:
+            # 途中で読むのをやめたときは, まだ始まっていないタスクを取り消す
+            for future in pending:
+                future.cancel()
+
+def _verify_task(items):
+    '''(sec, der, z) のリストを検証し, 1 件 1 バイト (1 なら成功) の結果を返す'''
+    return bytes(verify_serialized(items))
+
+class _ChunkedVerifier:
+    """self._executor に chunk 個ずつ _verify_task を投げて検証する VerifyPool と VerifyThreadPool の共通部分"""
+
+    # chunk を自動で決めるときの範囲
+    MIN_CHUNK = 32
+    MAX_CHUNK = 1024
+
+    def _chunk_size(self, count):
+        if self.chunk:
+            return self.chunk
+        size = -(-count // (self.workers * 4))
+        return max(self.MIN_CHUNK, min(self.MAX_CHUNK, size))
+
+    def verify(self, items, fast_fail=False):
+        '''各項目の検証結果を入力の順に bool のリストで返す
+
+        fast_fail が True なら, 失敗した署名が見つかった時点で残りのタスクを取り消す.
+        このとき検証されなかった項目は None になる.
+        '''
+        items = list(items)
+        size = self._chunk_size(len(items))
+        futures = {}
+        for start in range(0, len(items), size):
+            futures[self._executor.submit(_verify_task, items[start:start + size])] = start
+        results = [None] * len(items)
+        for future in as_completed(futures):
+            if future.cancelled():
+                continue
+            start = futures[future]
+            chunk = future.result()
+            results[start:start + len(chunk)] = [b == 1 for b in chunk]
+            if fast_fail and 0 in chunk:
+                for other in futures:
+                    other.cancel()
+                break
+        return results
+
+    def verify_all(self, items):
+        '''全ての署名が正しいか. 失敗が見つかれば残りの検証を取り消してすぐに返す'''
+        return all(self.verify(items, fast_fail=True))
+
+class VerifyPool(_ChunkedVerifier, _WorkerPool):
+    """シリアライズされた (sec, der 形式の署名, z) を複数プロセスで検証する
+
+    項目は chunk 個ずつワーカーに送って verify_serialized で検証し, 結果は 1 件 1 バイトで受け取る.
+    chunk を省略すると, プロセス間通信の回数がワーカーあたり数回になるように決める.
+    """
+
+    def __init__(self, workers=None, chunk=None, window=None, shared=True):
+        super().__init__(workers, window, shared)
+        self.chunk = chunk
+
+    def __repr__(self):
+        return f'VerifyPool(workers={self.workers}, chunk={self.chunk})'
+
+class VerifyThreadPool(_ChunkedVerifier):
+    """VerifyPool と同じことを 1 つのプロセスの複数スレッドで行う
+
+    G のテーブル, parse_cache, sig_cache は全てのスレッドで共有する.
+    GIL のある CPython では並列にならないので, VerifyPool を使うこと.
+    """
+
+    def __init__(self, workers=None, chunk=None):
+        self.workers = workers or os.cpu_count()
+        self.chunk = chunk
+        # 最初のタスクより前にテーブルを作っておく
+        generator_table()
+        self._executor = ThreadPoolExecutor(self.workers)
+
+    def __repr__(self):
+        return f'VerifyThreadPool(workers={self.workers}, chunk={self.chunk})'
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        self._executor.shutdown()
+
+class TestKeyPipeline(unittest.TestCase):
+
+    def test_records(self):
+        records = [(1, G.sec(), G.address()), (2 ** 255, (2 * G).sec(False), 'x' * 34)]
+        data = b''.join(pack_record(*r) for r in records)
+        self.assertEqual(list(unpack_records(data)), records)
+
+    def test_derive_range(self):
+        start = 0x12345deadbeef - 5
+        expected = list(derive_range(start, 10))
+        with KeyPipeline(workers=2, chunk=3) as pipeline:
+            self.assertEqual(list(pipeline.derive_range(start, 10)), expected)
+            results = list(pipeline.derive_range(5002, 1, compressed=False, testnet=True))
+            self.assertEqual(results[0][2], 'mmTPbXQFxboEtNRkwfh6K51jvdtHLxGeMA')
+            with self.assertRaises(ValueError):
+                next(pipeline.derive_range(0, 1))
+            # 鍵の範囲全体でも, 先にタスクを全て作らずに最初の結果を返す
+            results = pipeline.derive_range(1, N - 1)
+            self.assertEqual(next(results), next(derive_range(1, 1)))
+            results.close()
+
+    def test_share_generator_table(self):
+        shm = share_generator_table(3)
+        try:
+            table = GeneratorTable.from_buffer(shm.buf)
+            self.assertEqual(table.window, 3)
+            self.assertEqual(table.multiply(0xdeadbeef), GeneratorTable(3).multiply(0xdeadbeef))
+            del table
+        finally:
+            shm.close()
+            shm.unlink()
+
+    def test_unshared(self):
+        with KeyPipeline(workers=1, chunk=2, shared=False) as pipeline:
+            results = list(pipeline.derive_range(5, 3))
+        self.assertEqual(results, list(derive_range(5, 3)))
+
+    def test_from_secrets(self):
+        secrets = [5002, 2020 ** 5, 0x12345deadbeef, 7, 8]
+        with KeyPipeline(workers=2, chunk=2) as pipeline:
+            results = list(pipeline.from_secrets(secrets, testnet=True))
+            self.assertEqual(list(pipeline.from_secrets(iter(secrets), testnet=True)), results)
+            self.assertEqual(list(pipeline.from_secrets([])), [])
+        self.assertEqual([r[0] for r in results], secrets)
+        self.assertEqual(results[1][2], 'mopVkxp8UhXqRYbCYJsbeE1h1fiF64jcoH')
+        for secret, sec, address in results:
+            self.assertEqual(sec, PrivateKey(secret).point.sec())
+
+class TestVerifyPool(unittest.TestCase):
+
+    def items(self):
+        items = []
+        for i in range(10):
+            key = PrivateKey(0x5000 + i)
+            z = int.from_bytes(hash256(bytes([i])), 'big')
+            items.append((key.point.sec(i % 2 == 0), key.sign(z).der(), z))
+        return items
+
+    def test_verify(self):
+        items = self.items()
+        sec, der, z = items[3]
+        items[3] = (sec, der, z + 1)
+        items[5] = (items[5][0], b'\x30\x00', items[5][2])
+        items[7] = (b'\x02' + bytes(32), items[7][1], items[7][2])
+        expected = [i not in (3, 5, 7) for i in range(10)]
+        with VerifyPool(workers=2, chunk=3) as pool:
+            self.assertEqual(pool.verify(items), expected)
+            self.assertTrue(pool.verify_all(self.items()))
+            self.assertFalse(pool.verify_all(items))
+            results = pool.verify(items, fast_fail=True)
+            self.assertEqual(len(results), 10)
+            self.assertIn(False, results)
+            for result, ok in zip(results, expected):
+                self.assertIn(result, (None, ok))
+            self.assertEqual(pool.verify([]), [])
+
+    def test_chunk_size(self):
+        with VerifyPool(workers=2, shared=False) as pool:
+            self.assertEqual(pool._chunk_size(10), VerifyPool.MIN_CHUNK)
+            self.assertEqual(pool._chunk_size(800), 100)
+            self.assertEqual(pool._chunk_size(10 ** 6), VerifyPool.MAX_CHUNK)
+            self.assertEqual(pool.verify(self.items()), [True] * 10)
+
+class TestVerifyThreadPool(TestVerifyPool):
+
+    def test_verify(self):
+        items = self.items()
+        items[4] = (items[4][0], items[4][1], items[4][2] + 1)
+        expected = [i != 4 for i in range(10)]
+        with VerifyThreadPool(workers=4, chunk=3) as pool:
+            self.assertEqual(pool.verify(items), expected)
+            self.assertTrue(pool.verify_all(self.items()))
+            self.assertFalse(pool.verify_all(items))
+            self.assertEqual(pool.verify([]), [])
+
+    def test_chunk_size(self):
+        with VerifyThreadPool(workers=2) as pool:
+            self.assertEqual(pool._chunk_size(800), 100)
+            self.assertEqual(pool.verify(self.items()), [True] * 10)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,371 @@
+#!/usr/bin/env python3
+""" secp256k1 の整数演算モジュール
+
+有限体の要素は 0 以上 P 未満の int, 点はヤコビアン座標のタプル (X, Y, Z) で表す.
+(アフィン座標は x = X / Z^2, y = Y / Z^3, 無限遠点は Z = 0)
+オブジェクトを作らずに演算するので, ecc.py の S256Field, S256Point はこの上の薄いラッパーになる.
+"""
+
+import unittest
+from random import randint
+from helper import *
+import backend
+
+P = 2 ** 256 - 2 ** 32 - 977
+A = 0
+B = 7
+N = 0xfffffffffffffffffffffffffffffffebaaedce6af48a03bbfd25e8cd0364141
+GX = 0x79be667ef9dcbbac55a06295ce870b07029bfcdb2dce28d959f2815b16f81798
+GY = 0x483ada7726a3c4655da4fbfc0e1108a8fd17b448a68554199c47d08ffb10d4b8
+# 自己準同型 (x, y) -> (BETA * x, y) は LAMBDA 倍と等しい
+BETA = 0x7ae96a2b657c07106e64479eac3434e99cf0497512f58995c1396c28719501ee
+LAMBDA = 0x5363ad4cc05c30e0a5261c028812645a122e22ea20816678df02967c1b23bd72
+# GLV 分解に使う格子の基底 (a1 + b1 * LAMBDA = a2 + b2 * LAMBDA = 0 mod N)
+_GLV_A1 = 0x3086d221a7d46bcde86c90e49284eb15
+_GLV_B1 = -0xe4437ed6010e88286f547fa90abfe4c3
+_GLV_A2 = 0x114ca50f7a8e2f3f657c1108d9d44cfd8
+_GLV_B2 = _GLV_A1
+
+INFINITY = (1, 1, 0)
+
+# 点の演算で使う P. バックエンドが gmpy2 のときは mpz にして, mpz と int の混合演算での変換を省く
+_P = P
+
+def _set_backend(arith):
+    global _P
+    _P = arith.mpz(P)
+
+backend.register(_set_backend)
+
+def field_inverse(a):
+    '''a の逆元 (mod P) を返す'''
+    return backend.invert(a, P)
+
+def field_sqrt(a):
+    '''a の平方根 (mod P) のひとつを返す. P = 3 (mod 4) なので 1 回のべき乗で求まる'''
+    return backend.powmod(a, (P + 1) // 4, P)
+
+def is_on_curve(x, y):
+    '''アフィン座標 (x, y) が y^2 = x^3 + 7 を満たすか'''
+    return 0 <= x < P and 0 <= y < P and (y * y - x * x * x - B) % P == 0
+
+def jacobian_double(p):
+    '''ヤコビアン座標の点を2倍する (a = 0 の曲線用)'''
+    x1, y1, z1 = p
+    if z1 == 0 or y1 == 0:
+        return INFINITY
+    yy = y1 * y1 % _P
+    s = 4 * x1 * yy % _P
+    m = 3 * x1 * x1 % _P
+    x3 = (m * m - 2 * s) % _P
+    y3 = (m * (s - x3) - 8 * yy * yy) % _P
+    z3 = 2 * y1 * z1 % _P
+    return (x3, y3, z3)
+
+def jacobian_add(p, q):
+    '''ヤコビアン座標の点同士を加算する. 逆元の計算は行わない'''
+    x1, y1, z1 = p
+    x2, y2, z2 = q
+    if z1 == 0:
+        return q
+    if z2 == 0:
+        return p
+    z1z1 = z1 * z1 % _P
+    z2z2 = z2 * z2 % _P
+    u1 = x1 * z2z2 % _P
+    u2 = x2 * z1z1 % _P
+    s1 = y1 * z2 * z2z2 % _P
+    s2 = y2 * z1 * z1z1 % _P
+    if u1 == u2:
+        if s1 != s2:
+            return INFINITY
+        return jacobian_double(p)
+    h = (u2 - u1) % _P
+    r = (s2 - s1) % _P
+    hh = h * h % _P
+    hhh = h * hh % _P
+    v = u1 * hh % _P
+    x3 = (r * r - hhh - 2 * v) % _P
+    y3 = (r * (v - x3) - s1 * hhh) % _P
+    z3 = h * z1 * z2 % _P
+    return (x3, y3, z3)
+
+def jacobian_add_affine(p, q):
+    '''ヤコビアン座標の点にアフィン座標の点 q = (x, y) を加算する (Z2 = 1)'''
+    x1, y1, z1 = p
+    x2, y2 = q
+    if z1 == 0:
+        return (x2, y2, 1)
+    z1z1 = z1 * z1 % _P
+    u2 = x2 * z1z1 % _P
+    s2 = y2 * z1 * z1z1 % _P
+    if x1 == u2:
+        if y1 != s2:
+            return INFINITY
+        return jacobian_double(p)
+    h = (u2 - x1) % _P
+    r = (s2 - y1) % _P
+    hh = h * h % _P
+    hhh = h * hh % _P
+    v = x1 * hh % _P
+    x3 = (r * r - hhh - 2 * v) % _P
+    y3 = (r * (v - x3) - y1 * hhh) % _P
+    z3 = h * z1 % _P
+    return (x3, y3, z3)
+
+def jacobian_negate(p):
+    x, y, z = p
+    return (x, (_P - y) % _P, z)
+
+def jacobian_equal(p, q):
+    '''逆元を使わずにヤコビアン座標の点が等しいか判定する'''
+    x1, y1, z1 = p
+    x2, y2, z2 = q
+    if z1 == 0 or z2 == 0:
+        return z1 == z2
+    z1z1 = z1 * z1 % _P
+    z2z2 = z2 * z2 % _P
+    return x1 * z2z2 % _P == x2 * z1z1 % _P \
+        and y1 * z2 * z2z2 % _P == y2 * z1 * z1z1 % _P
+
+def jacobian_to_affine(p):
+    '''ヤコビアン座標を整数のアフィン座標 (x, y) に変換する'''
+    x, y, z = p
+    z_inv = field_inverse(z)
+    z_inv2 = z_inv * z_inv % _P
+    # 座標が mpz の場合も int で返す
+    return (int(x * z_inv2 % _P), int(y * z_inv2 * z_inv % _P))
+
+def jacobian_batch_to_affine(points):
+    '''ヤコビアン座標の点のリストを 1 回の逆元計算でアフィン座標に変換する
+
+    無限遠点は None になる.
+    '''
+    finite = [i for i, p in enumerate(points) if p[2] != 0]
+    z_invs = batch_inverse_mod([points[i][2] for i in finite], _P)
+    result = [None] * len(points)
+    for i, z_inv in zip(finite, z_invs):
+        x, y, _ = points[i]
+        z_inv2 = z_inv * z_inv % _P
+        result[i] = (int(x * z_inv2 % _P), int(y * z_inv2 * z_inv % _P))
+    return result
+
+def _odd_multiples(p, window):
+    '''wNAF 用の奇数倍 p, 3p, 5p, ... (2^(window-2) 個) とその符号反転を返す'''
+    double = jacobian_double(p)
+    odd = [p]
+    for _ in range((1 << (window - 2)) - 1):
+        odd.append(jacobian_add(odd[-1], double))
+    return odd, [jacobian_negate(q) for q in odd]
+
+def jacobian_multiply(p, coefficient, window):
+    '''ヤコビアン座標の点 p の coefficient 倍を wNAF (window = 1 ならバイナリ法) で計算する'''
+    p = tuple(map(backend.mpz, p))
+    result = INFINITY
+    if window == 1:
+        while coefficient:
+            if coefficient & 1:
+                result = jacobian_add(result, p)
+            p = jacobian_double(p)
+            coefficient >>= 1
+        return result
+    odd, neg = _odd_multiples(p, window)
+    for d in reversed(wnaf(coefficient, window)):
+        result = jacobian_double(result)
+        if d > 0:
+            result = jacobian_add(result, odd[d >> 1])
+        elif d < 0:
+            result = jacobian_add(result, neg[-d >> 1])
+    return result
+
+def jacobian_strauss(terms, window, fixed=()):
+    '''(点, 非負のスカラー) の組の和をひとつの 2 倍算の列で計算する (wNAF による Strauss 法)
+
+    fixed には奇数倍を事前に計算してある項を (非負のスカラー, 窓幅, 奇数倍, その符号反転) の組で渡す.
+    奇数倍はアフィン座標の点 p, 3p, 5p, ... のリストで, 表を作らずに混合加算で加える.
+    '''
+    tables = []
+    for p, coefficient in terms:
+        odd, neg = _odd_multiples(tuple(map(backend.mpz, p)), window)
+        tables.append((coefficient, window, odd, neg, jacobian_add))
+    for coefficient, fixed_window, odd, neg in fixed:
+        tables.append((coefficient, fixed_window, odd, neg, jacobian_add_affine))
+    # 桁の位置ごとに加算する (加算の関数, 点) を並べておき, 2 倍算の列では 0 の桁を調べない
+    schedule = [None] * max((t[0].bit_length() + 1 for t in tables), default=0)
+    for coefficient, w, odd, neg, add in tables:
+        for i, d in sparse_wnaf(coefficient, w):
+            if schedule[i] is None:
+                schedule[i] = []
+            schedule[i].append((add, odd[d >> 1] if d > 0 else neg[-d >> 1]))
+    result = INFINITY
+    for adds in reversed(schedule):
+        result = jacobian_double(result)
+        if adds:
+            for add, q in adds:
+                result = add(result, q)
+    return result
+
+def affine_odd_multiples(points, window):
+    '''点ごとの wNAF 用の奇数倍とその符号反転を, アフィン座標の (odd, neg) のリストで返す
+
+    全ての点の奇数倍を 1 回の逆元計算でまとめてアフィン座標にするので, 点の数が多いほど
+    1 点あたりの逆元の費用が下がる. 結果は jacobian_strauss の fixed に渡せる. 無限遠点は渡せない.
+    '''
+    size = 1 << (window - 2)
+    multiples = []
+    for p in points:
+        multiples.extend(_odd_multiples(tuple(map(backend.mpz, p)), window)[0])
+    mpz = backend.mpz
+    affine = [(mpz(x), mpz(y)) for x, y in jacobian_batch_to_affine(multiples)]
+    result = []
+    for i in range(0, len(affine), size):
+        odd = affine[i:i + size]
+        result.append((odd, [(x, _P - y) for x, y in odd]))
+    return result
+
+def glv_fixed_terms(table, coefficient, window):
+    '''coefficient * p を GLV 分解した jacobian_strauss の fixed の 2 項を返す
+
+    p は affine_odd_multiples() の表 (odd, neg) で渡す. 自己準同型の点の奇数倍は x に BETA を掛けるだけで求まる.
+    '''
+    k1, k2 = glv_split(coefficient)
+    odd, neg = table
+    endo_odd = [(BETA * x % _P, y) for x, y in odd]
+    endo_neg = [(x, _P - y) for x, y in endo_odd]
+    return [(abs(k1), window) + ((odd, neg) if k1 >= 0 else (neg, odd)),
+            (abs(k2), window) + ((endo_odd, endo_neg) if k2 >= 0 else (endo_neg, endo_odd))]
+
+def pippenger_window(count, bits=256):
+    '''count 項の Pippenger 法で加算の回数 ceil(bits / c) * (count + 2^(c+1)) が最小になる窓幅 c'''
+    return min(range(1, 17), key=lambda c: (bits + c - 1) // c * (count + (2 << c)))
+
+def jacobian_pippenger(terms, window):
+    '''(点, 非負のスカラー) の組の和を Pippenger のバケット法で計算する
+
+    スカラーを上位から window ビットずつ区切り, 区切りの値 d ごとのバケットに点を足してから
+    sum(d * バケット[d]) を累積和 2 回で求める. 点は先にまとめてアフィン座標にし, 混合加算を使う.
+    '''
+    affine = jacobian_batch_to_affine([p for p, _ in terms])
+    terms = [((backend.mpz(xy[0]), backend.mpz(xy[1])), k)
+             for xy, (_, k) in zip(affine, terms) if xy is not None and k]
+    if not terms:
+        return INFINITY
+    bits = max(k.bit_length() for _, k in terms)
+    mask = (1 << window) - 1
+    result = INFINITY
+    for shift in range((bits - 1) // window * window, -1, -window):
+        for _ in range(window):
+            result = jacobian_double(result)
+        buckets = [INFINITY] * (mask + 1)
+        for xy, k in terms:
+            d = k >> shift & mask
+            if d:
+                buckets[d] = jacobian_add_affine(buckets[d], xy)
+        # running = buckets[d] + ... + buckets[mask] を足していくと sum(d * buckets[d]) になる
+        running = INFINITY
+        total = INFINITY
+        for d in range(mask, 0, -1):
+            running = jacobian_add(running, buckets[d])
+            total = jacobian_add(total, running)
+        result = jacobian_add(result, total)
+    return result
+
+def glv_split(coefficient):
+    '''k = k1 + k2 * LAMBDA (mod N) を満たす約 128 ビットの (k1, k2) を返す. 符号付き'''
+    k = coefficient % N
+    c1 = (_GLV_B2 * k + N // 2) // N
+    c2 = (-_GLV_B1 * k + N // 2) // N
+    k1 = k - c1 * _GLV_A1 - c2 * _GLV_A2
+    k2 = -c1 * _GLV_B1 - c2 * _GLV_B2
+    return k1, k2
+
+def glv_terms(p, coefficient):
+    '''coefficient * p を jacobian_strauss 用の 2 つの半分の長さの項に分解する'''
+    k1, k2 = glv_split(coefficient)
+    x, y, z = p
+    neg_y = (_P - y) % _P
+    endo_x = BETA * x % _P
+    return [((x, y if k1 >= 0 else neg_y, z), abs(k1)),
+            ((endo_x, y if k2 >= 0 else neg_y, z), abs(k2))]
+
+class TestSecp256k1(unittest.TestCase):
+
+    def test_is_on_curve(self):
+        self.assertTrue(is_on_curve(GX, GY))
+        self.assertFalse(is_on_curve(GX, GY + 1))
+        self.assertFalse(is_on_curve(GX, GY + P))
+
+    def test_field_sqrt(self):
+        y = field_sqrt((GX ** 3 + B) % P)
+        self.assertIn(y, (GY, P - GY))
+        self.assertEqual(GX * field_inverse(GX) % P, 1)
+
+    def test_double_and_add(self):
+        g = (GX, GY, 1)
+        g2 = jacobian_double(g)
+        self.assertTrue(jacobian_equal(g2, jacobian_add(g, g)))
+        self.assertTrue(jacobian_equal(g2, jacobian_add_affine(g, (GX, GY))))
+        self.assertTrue(is_on_curve(*jacobian_to_affine(g2)))
+        g3 = jacobian_add(g2, g)
+        self.assertTrue(jacobian_equal(g3, jacobian_add_affine(g2, (GX, GY))))
+        self.assertEqual(jacobian_add(g, jacobian_negate(g))[2], 0)
+        self.assertEqual(jacobian_add_affine(jacobian_negate(g), (GX, GY))[2], 0)
+        self.assertEqual(jacobian_add(INFINITY, g), g)
+
+    def test_batch_to_affine(self):
+        g = (GX, GY, 1)
+        points = [g, jacobian_double(g), INFINITY, jacobian_multiply(g, 12345, 4)]
+        affine = jacobian_batch_to_affine(points)
+        self.assertEqual(affine[0], (GX, GY))
+        self.assertIsNone(affine[2])
+        for p, xy in zip(points, affine):
+            if xy is not None:
+                self.assertEqual(xy, jacobian_to_affine(p))
+
+    def test_multiply(self):
+        g = (GX, GY, 1)
+        for k in (1, 2, 3, 0xdeadbeef, N - 1, randint(1, N - 1)):
+            expected = jacobian_multiply(g, k, 1)
+            for window in (2, 4, 5):
+                self.assertTrue(jacobian_equal(jacobian_multiply(g, k, window), expected))
+            self.assertTrue(jacobian_equal(jacobian_strauss(glv_terms(g, k), 4), expected))
+            # G の奇数倍をアフィン座標で渡す
+            odd = [jacobian_to_affine(q) for q in _odd_multiples(g, 3)[0]]
+            neg = [(x, P - y) for x, y in odd]
+            self.assertTrue(jacobian_equal(jacobian_strauss([], 2, [(k, 3, odd, neg)]), expected))
+            self.assertTrue(jacobian_equal(jacobian_strauss([(g, 12345)], 4, [(k, 3, odd, neg)]),
+                                           jacobian_multiply(g, k + 12345, 4)))
+        self.assertEqual(jacobian_strauss([], 4)[2], 0)
+        self.assertEqual(jacobian_multiply(g, N, 5)[2], 0)
+
+    def test_affine_odd_multiples(self):
+        g = (GX, GY, 1)
+        points = [g, jacobian_multiply(g, 0xdeadbeef, 4), jacobian_double(g)]
+        tables = affine_odd_multiples(points, 4)
+        self.assertEqual(len(tables), 3)
+        for p, (odd, neg) in zip(points, tables):
+            self.assertEqual(odd, [jacobian_to_affine(q) for q in _odd_multiples(p, 4)[0]])
+            self.assertEqual(neg, [jacobian_to_affine(q) for q in _odd_multiples(p, 4)[1]])
+            for k in (1, 12345, N - 1, randint(1, N - 1)):
+                expected = jacobian_multiply(p, k, 4)
+                self.assertTrue(jacobian_equal(jacobian_strauss([], 4, [(k, 4, odd, neg)]), expected))
+                self.assertTrue(jacobian_equal(
+                    jacobian_strauss([], 4, glv_fixed_terms((odd, neg), k, 4)), expected))
+        self.assertEqual(affine_odd_multiples([], 5), [])
+
+    def test_pippenger(self):
+        g = (GX, GY, 1)
+        points = [jacobian_multiply(g, i + 2, 4) for i in range(20)] + [INFINITY, g]
+        scalars = [randint(0, N - 1) for _ in points[:-2]] + [5, 0]
+        terms = list(zip(points, scalars))
+        expected = jacobian_strauss(terms, 4)
+        for window in (1, 3, 4, 8):
+            self.assertTrue(jacobian_equal(jacobian_pippenger(terms, window), expected))
+        # P + (N - 1) P = 無限遠点
+        self.assertEqual(jacobian_pippenger([(g, 1), (g, N - 1)], 4)[2], 0)
+        self.assertEqual(jacobian_pippenger([(g, 0), (INFINITY, 3)], 4)[2], 0)
+        self.assertLessEqual(pippenger_window(2), pippenger_window(100))
+        self.assertLess(pippenger_window(100), pippenger_window(10000))
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,422 @@
+#!/usr/bin/env python3
+""" 署名と検証を行うローカルサーバ
+
+Unix ソケットで 1 行 1 件の JSON を受け取り, 要求を短い時間だけ溜めてまとめて処理する.
+
+    {"id": 1, "op": "sign", "z": "<16進数>"}
+    -> {"id": 1, "der": "<16進数>"}
+    {"id": 2, "op": "verify", "sec": "<16進数>", "der": "<16進数>", "z": "<16進数>"}
+    -> {"id": 2, "valid": true}
+
+python signserver.py serve --socket PATH --secret-file FILE でサーバを起動し,
+python signserver.py loadtest [--socket PATH] で負荷をかけてレイテンシを測る.
+"""
+
+import unittest
+import argparse
+import asyncio
+import json
+import os
+import sys
+import tempfile
+import time
+from ecc import *
+
+class MicroBatcher:
+    """非同期に受け取った要求を溜めて, まとめて func(items) に渡す
+
+    最初の要求から max_delay 秒経つか max_batch 件溜まった時点で executor 上で func を呼ぶ.
+    func は items と同じ長さの結果のリストを返すこと. 結果が例外のインスタンスの項目は,
+    submit() がその例外を送出する. (func 自体が送出した例外はバッチの全ての項目に送出する)
+    """
+
+    def __init__(self, func, max_batch=64, max_delay=0.002, executor=None):
+        self.func = func
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self.executor = executor
+        self.batches = 0
+        self.items = 0
+        self._queue = None
+        self._task = None
+
+    def __repr__(self):
+        return f'MicroBatcher(max_batch={self.max_batch}, max_delay={self.max_delay})'
+
+    async def submit(self, item):
+        '''item を処理して結果を返す'''
+        if self._task is None:
+            self._queue = asyncio.Queue()
+            self._task = asyncio.create_task(self._run())
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((item, future))
+        return await future
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self._queue.get()]
+            deadline = loop.time() + self.max_delay
+            while len(batch) < self.max_batch:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+            self.batches += 1
+            self.items += len(batch)
+            try:
+                results = await loop.run_in_executor(self.executor, self.func,
+                                                     [item for item, _ in batch])
+            except Exception as e:
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+            for (_, future), result in zip(batch, results):
+                if future.done():
+                    continue
+                if isinstance(result, Exception):
+                    future.set_exception(result)
+                else:
+                    future.set_result(result)
+
+def _sign_items(key, zs):
+    '''zs をまとめて署名して DER のリストを返す. 署名できなかった項目は例外のインスタンスになる'''
+    try:
+        return [sig.der() for sig in sign_batch([(key, z) for z in zs])]
+    except Exception:
+        # 1 件の失敗でバッチ全体を失敗させないよう, 1 件ずつ署名し直す
+        results = []
+        for z in zs:
+            try:
+                results.append(sign_batch([(key, z)])[0].der())
+            except Exception as e:
+                results.append(e)
+        return results
+
+def _parse_z(text):
+    '''16進数の文字列の z を 0 以上 2^256 未満の整数にする'''
+    z = int(text, 16)
+    if not 0 <= z < 2 ** 256:
+        raise ValueError(f'z {text} not in range 0 to 2^256 - 1')
+    return z
+
+class SignServer:
+    """key で署名し, 任意の公開鍵の署名を検証する Unix ソケットのサーバ
+
+    sign と verify の要求はそれぞれ MicroBatcher で溜め, sign_batch と verify_serialized で処理する.
+    """
+
+    def __init__(self, key, max_batch=64, max_delay=0.002, executor=None):
+        self.key = key
+        self.signer = MicroBatcher(lambda zs: _sign_items(key, zs), max_batch, max_delay, executor)
+        self.verifier = MicroBatcher(verify_serialized, max_batch, max_delay, executor)
+        self._server = None
+
+    def __repr__(self):
+        return f'SignServer({self.key.point.sec().hex()})'
+
+    async def start(self, path):
+        self._server = await asyncio.start_unix_server(self._handle, path)
+        return self._server
+
+    async def close(self):
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+        await self.signer.close()
+        await self.verifier.close()
+
+    async def _handle(self, reader, writer):
+        tasks = set()
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                # 1 つの接続で複数の要求を同時に処理できるよう, 応答は完了した順に返す
+                task = asyncio.create_task(self._respond(line, writer))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+            if tasks:
+                await asyncio.gather(*tasks)
+        finally:
+            writer.close()
+
+    async def _respond(self, line, writer):
+        response = {'id': None}
+        try:
+            request = json.loads(line)
+            if not isinstance(request, dict):
+                raise ValueError('request must be a JSON object')
+            response['id'] = request.get('id')
+            response.update(await self._dispatch(request))
+        except Exception as e:
+            # 処理できない要求にも必ず応答を返す
+            response['error'] = f'{type(e).__name__}: {e}'
+        writer.write(json.dumps(response).encode() + b'\n')
+
+    async def _dispatch(self, request):
+        op = request['op']
+        if op == 'sign':
+            der = await self.signer.submit(_parse_z(request['z']))
+            return {'der': der.hex()}
+        if op == 'verify':
+            item = (bytes.fromhex(request['sec']), bytes.fromhex(request['der']),
+                    _parse_z(request['z']))
+            return {'valid': await self.verifier.submit(item)}
+        raise ValueError(f'unknown op {op}')
+
+class SignClient:
+    """SignServer のクライアント. 1 つの接続で複数の要求を同時に送れる"""
+
+    def __init__(self, reader, writer):
+        self._reader = reader
+        self._writer = writer
+        self._next_id = 0
+        self._pending = {}
+        self._task = asyncio.create_task(self._receive())
+
+    @classmethod
+    async def connect(cls, path):
+        reader, writer = await asyncio.open_unix_connection(path)
+        return cls(reader, writer)
+
+    async def close(self):
+        self._writer.close()
+        await self._writer.wait_closed()
+        self._task.cancel()
+
+    async def request(self, **request):
+        self._next_id += 1
+        request['id'] = self._next_id
+        future = asyncio.get_running_loop().create_future()
+        self._pending[self._next_id] = future
+        self._writer.write(json.dumps(request).encode() + b'\n')
+        response = await future
+        if 'error' in response:
+            raise ValueError(response['error'])
+        return response
+
+    async def sign(self, z):
+        response = await self.request(op='sign', z=f'{z:x}')
+        return Signature.parse(bytes.fromhex(response['der']))
+
+    async def verify(self, sec, sig, z):
+        response = await self.request(op='verify', sec=sec.hex(), der=sig.der().hex(), z=f'{z:x}')
+        return response['valid']
+
+    async def _receive(self):
+        while True:
+            line = await self._reader.readline()
+            if not line:
+                break
+            response = json.loads(line)
+            # 要求の形式が不正で id の無い応答は, 対応する要求が分からないので捨てる
+            future = self._pending.pop(response.get('id'), None)
+            if future is not None:
+                future.set_result(response)
+
+def percentile(values, p):
+    '''ソート済みの values の p パーセンタイル'''
+    return values[min(len(values) - 1, int(len(values) * p / 100))]
+
+async def load_test(path, requests=1000, concurrency=32, op='sign', sec=None):
+    '''path のサーバに concurrency 本の並行した要求を合計 requests 件送り, レイテンシを集計する
+
+    op が verify のときは sec の公開鍵で検証する署名をサーバ自身に作らせる.
+    '''
+    client = await SignClient.connect(path)
+    try:
+        if op == 'verify':
+            z = 0xdeadbeef
+            sig = await client.sign(z)
+        latencies = []
+        counter = iter(range(requests))
+
+        async def worker():
+            for i in counter:
+                start = time.perf_counter()
+                if op == 'sign':
+                    await client.sign(i + 1)
+                else:
+                    await client.verify(sec, sig, z)
+                latencies.append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        elapsed = time.perf_counter() - start
+    finally:
+        await client.close()
+    latencies.sort()
+    return {
+        'requests': requests,
+        'throughput': requests / elapsed,
+        'p50': percentile(latencies, 50),
+        'p99': percentile(latencies, 99),
+    }
+
+async def _serve(args):
+    with open(args.secret_file) as f:
+        key = PrivateKey(int(f.read().strip(), 16))
+    server = SignServer(key, args.max_batch, args.max_delay / 1000)
+    await server.start(args.socket)
+    print(f'listening on {args.socket}', file=sys.stderr)
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await server.close()
+
+async def _loadtest(args):
+    server = None
+    path = args.socket
+    with tempfile.TemporaryDirectory() as tmpdir:
+        if path is None:
+            # ソケットが指定されなければ同じプロセスでサーバを起動する
+            path = os.path.join(tmpdir, 'sign.sock')
+            server = SignServer(PrivateKey(12345), args.max_batch, args.max_delay / 1000)
+            await server.start(path)
+        try:
+            sec = server.key.point.sec() if server else bytes.fromhex(args.sec)
+            result = await load_test(path, args.requests, args.concurrency, args.op, sec)
+        finally:
+            if server:
+                await server.close()
+    print(f'{args.op}: {result["requests"]} requests, {result["throughput"]:.0f} req/s, '
+          f'p50 {result["p50"] * 1000:.2f} ms, p99 {result["p99"] * 1000:.2f} ms')
+
+class TestSignServer(unittest.TestCase):
+
+    def test_micro_batcher(self):
+        async def run():
+            batcher = MicroBatcher(lambda items: [i * 2 for i in items], max_batch=4, max_delay=0.05)
+            results = await asyncio.gather(*(batcher.submit(i) for i in range(10)))
+            await batcher.close()
+            return results, batcher
+        results, batcher = asyncio.run(run())
+        self.assertEqual(results, [i * 2 for i in range(10)])
+        self.assertEqual(batcher.items, 10)
+        self.assertLess(batcher.batches, 10)
+
+    def test_micro_batcher_errors(self):
+        async def run():
+            batcher = MicroBatcher(lambda items: [ValueError(i) if i % 3 == 0 else i for i in items],
+                                   max_batch=8, max_delay=0.05)
+            results = await asyncio.gather(*(batcher.submit(i) for i in range(6)),
+                                           return_exceptions=True)
+            await batcher.close()
+            return results
+        results = asyncio.run(run())
+        self.assertEqual([r for r in results if not isinstance(r, ValueError)], [1, 2, 4, 5])
+        self.assertIsInstance(results[0], ValueError)
+        self.assertIsInstance(results[3], ValueError)
+
+    def test_server(self):
+        key = PrivateKey(0x12345)
+        async def run(path):
+            server = SignServer(key, max_delay=0.01)
+            await server.start(path)
+            client = await SignClient.connect(path)
+            try:
+                sigs = await asyncio.gather(*(client.sign(z) for z in range(1, 9)))
+                valid = await asyncio.gather(*(client.verify(key.point.sec(), sig, z)
+                                               for z, sig in zip(range(1, 9), sigs)))
+                invalid = await client.verify(key.point.sec(), sigs[0], 2)
+                malformed = await client.verify(b'\x02' + bytes(32), sigs[0], 1)
+                with self.assertRaises(ValueError):
+                    await client.request(op='unknown')
+                result = await load_test(path, requests=20, concurrency=4, op='verify',
+                                         sec=key.point.sec())
+            finally:
+                await client.close()
+                await server.close()
+            return sigs, valid, invalid, malformed, result, server
+        with tempfile.TemporaryDirectory() as tmpdir:
+            sigs, valid, invalid, malformed, result, server = \
+                asyncio.run(run(os.path.join(tmpdir, 'sign.sock')))
+        for z, sig in zip(range(1, 9), sigs):
+            expected = key.sign(z)
+            self.assertEqual((sig.r, sig.s), (expected.r, expected.s))
+        self.assertEqual(valid, [True] * 8)
+        self.assertFalse(invalid)
+        self.assertFalse(malformed)
+        self.assertLess(server.signer.batches, 8)
+        self.assertEqual(result['requests'], 20)
+        self.assertLessEqual(result['p50'], result['p99'])
+
+    def test_bad_requests(self):
+        key = PrivateKey(0x12345)
+        async def run(path):
+            server = SignServer(key, max_delay=0.05)
+            await server.start(path)
+            client = await SignClient.connect(path)
+            try:
+                # 同じバッチに入る正しい要求と不正な要求
+                bad = [{'op': 'sign', 'z': '-1'}, {'op': 'sign', 'z': f'{2 ** 256:x}'},
+                       {'op': 'sign', 'z': 5}, {'op': 'sign'},
+                       {'op': 'verify', 'sec': '02', 'der': '30', 'z': '-5'}]
+                tasks = [client.sign(5), client.sign(6)] + [client.request(**r) for r in bad]
+                client._writer.write(b'[1]\n')
+                results = await asyncio.wait_for(asyncio.gather(*tasks, return_exceptions=True), 10)
+                # 不正な要求の後も同じ接続で処理できる
+                after = await asyncio.wait_for(client.sign(7), 10)
+            finally:
+                await client.close()
+                await server.close()
+            return results, after
+        with tempfile.TemporaryDirectory() as tmpdir:
+            results, after = asyncio.run(run(os.path.join(tmpdir, 'sign.sock')))
+        for z, sig in zip((5, 6), results):
+            expected = key.sign(z)
+            self.assertEqual((sig.r, sig.s), (expected.r, expected.s))
+        for error in results[2:]:
+            self.assertIsInstance(error, ValueError)
+        self.assertIn('not in range', str(results[2]))
+        self.assertEqual((after.r, after.s), (key.sign(7).r, key.sign(7).s))
+
+    def test_sign_items(self):
+        key = PrivateKey(0x12345)
+        # deterministic_k は負の z を to_bytes(32) できない
+        results = _sign_items(key, [1, -1, 2])
+        self.assertEqual(results[0], key.sign(1).der())
+        self.assertIsInstance(results[1], OverflowError)
+        self.assertEqual(results[2], key.sign(2).der())
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    sub = parser.add_subparsers(dest='command', required=True)
+    serve = sub.add_parser('serve', help='サーバを起動する')
+    serve.add_argument('--socket', required=True)
+    serve.add_argument('--secret-file', required=True, help='16進数の秘密鍵を書いたファイル')
+    loadtest = sub.add_parser('loadtest', help='負荷をかけて p50/p99 レイテンシを測る')
+    loadtest.add_argument('--socket', help='省略すると同じプロセスでサーバを起動する')
+    loadtest.add_argument('--sec', help='verify で使う公開鍵 (--socket を指定したとき)')
+    loadtest.add_argument('--op', choices=['sign', 'verify'], default='sign')
+    loadtest.add_argument('-n', '--requests', type=int, default=1000)
+    loadtest.add_argument('-c', '--concurrency', type=int, default=32)
+    for p in (serve, loadtest):
+        p.add_argument('--max-batch', type=int, default=64)
+        p.add_argument('--max-delay', type=float, default=2.0, help='バッチを溜める時間 (ミリ秒)')
+    args = parser.parse_args()
+    if args.command == 'loadtest' and args.op == 'verify' and args.socket and not args.sec:
+        parser.error('--sec is required for verify against an external server')
+    asyncio.run(_serve(args) if args.command == 'serve' else _loadtest(args))
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] in ('serve', 'loadtest'):
+        main()
+    else:
+        unittest.main()